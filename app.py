@@ -1,11 +1,16 @@
 import streamlit as st
 
-from aqua import ui, data, processing, ml, plots
+from aqua import ui, data, processing, ml, plots, pipeline, profiling, registry, tuning
+from aqua._constant import residual_modes
 
+performance_records = profiling.start()
 ui.make_title()
 processing_options, modelling_options = ui.make_sidebar()
 
-raw_data = data.load_raw_data().pipe(processing.process_force_data, processing_options)
+loaded_data = data.load_raw_data(targets=modelling_options["targets"])
+# all processing variants are computed once per data, switching options only
+# selects one of them
+raw_data = loaded_data.pipe(processing.process_force_data, processing_options)
 
 st.markdown("## 1. Data description")
 
@@ -22,36 +27,146 @@ st.markdown("### 1.2 Targets")
 plots.plot_targets(targets)
 
 st.markdown("### 1.3 Correlation matrix")
-plots.plot_correlation_matrix(variables, targets)
-
-st.markdown("## 2. Data modelling")
-X_train, X_test, y_train, y_test = ml.train_test_split(
-    variables, targets, modelling_options["test_size"]
+correlation_method = st.selectbox(
+    "Correlation coefficient", ["pearson", "spearman"], key="correlation-method"
 )
+plots.plot_correlation_matrix(variables, targets, correlation_method)
 
-st.markdown(
-    f"Train split size: `{X_train.shape[0]}` ({X_train.shape[0] / raw_data.shape[0]:.2f}%)"
+st.markdown("## 2. Data modelling")
+cross_validation = modelling_options["evaluation"] == "Cross-validation"
+if cross_validation:
+    # models explained below are fitted on all the rows
+    X_train, y_train = variables, targets
+    st.markdown(
+        f"Repeated k-fold: `{modelling_options['n_repeats']}` x "
+        f"`{modelling_options['n_splits']}` folds"
+    )
+else:
+    X_train, X_test, y_train, y_test = ml.train_test_split(
+        variables, targets, modelling_options["test_size"]
+    )
+
+    st.markdown(
+        f"Train split size: `{X_train.shape[0]}` ({X_train.shape[0] / raw_data.shape[0]:.2f}%)"
+    )
+    st.markdown(
+        f"Test split size: `{X_test.shape[0]}` ({X_test.shape[0] / raw_data.shape[0]:.2f}%)"
+    )
+
+params = (
+    tuning.tune_models(
+        X_train,
+        y_train,
+        modelling_options["models"],
+        multioutput=modelling_options["multioutput"],
+    )
+    if modelling_options["tune"]
+    else None
 )
-st.markdown(
-    f"Test split size: `{X_test.shape[0]}` ({X_test.shape[0] / raw_data.shape[0]:.2f}%)"
+if params:
+    st.markdown(
+        "Tuned hyperparameters (cross-validation scores tune each fold separately):"
+        if cross_validation
+        else "Tuned hyperparameters:"
+    )
+    st.json(params)
+
+if cross_validation:
+    # the hyperparameters above are tuned on all the rows, the scores use a search
+    # nested in each training fold instead
+    fold_params = (
+        tuning.tune_folds(
+            variables,
+            targets,
+            modelling_options["models"],
+            modelling_options["n_splits"],
+            modelling_options["n_repeats"],
+            multioutput=modelling_options["multioutput"],
+        )
+        if modelling_options["tune"]
+        else None
+    )
+    cv_predictions = ml.cross_validate(
+        variables,
+        targets,
+        modelling_options["models"],
+        modelling_options["n_splits"],
+        modelling_options["n_repeats"],
+        multioutput=modelling_options["multioutput"],
+        params=params,
+        fold_params=fold_params,
+    )
+
+st.markdown(f"### 2.1 {modelling_options['evaluation']} evaluation")
+
+models = registry.train_models(
+    X_train,
+    y_train,
+    modelling_options["models"],
+    processing_options,
+    data.raw_data_path,
+    multioutput=modelling_options["multioutput"],
+    params=params,
 )
 
-st.markdown("### 2.1 Test split evaluation")
+residual_mode = st.selectbox("Residuals display", residual_modes, key="residual-mode")
 
 predictions_list = []
-for model_name in modelling_options["models"]:
+for model_name, model in models.items():
     st.markdown(f"#### {model_name}")
 
-    model = ml.train_model(X_train, y_train, model_name)
-    predictions = ml.predict(X_test, y_test, model).pipe(ml.evaluation)
+    predictions = (
+        cv_predictions[model_name]
+        if cross_validation
+        else ml.predict(X_test, y_test, model)
+    ).pipe(ml.evaluation)
     plots.plot_error_dist(predictions)
-    plots.plot_error_residuals(predictions)
-
-    if "Regression" not in model_name:
-        # shap_values = ml.get_shap_values(variables, model, is_tree="Regression" not in model_name)
-        plots.plot_shap_values(variables, model)
+    plots.plot_error_residuals(predictions, residual_mode)
+
+    # importances are measured on held-out rows, the test split or the folds
+    plots.plot_permutation_importance(
+        ml.cv_permutation_importance(
+            variables,
+            targets,
+            modelling_options["models"],
+            modelling_options["n_splits"],
+            modelling_options["n_repeats"],
+            multioutput=modelling_options["multioutput"],
+            params=params,
+            fold_params=fold_params,
+        )[model_name]
+        if cross_validation
+        else ml.permutation_importance(X_test, y_test, model)
+    )
+    if "Regression" in model_name:
+        plots.plot_coefficient_path(ml.coefficient_path(X_train, y_train))
+    else:
+        shap_values = ml.get_shap_values(
+            variables, model, modelling_options["feature_perturbation"]
+        )
+        plots.plot_shap_values(variables, shap_values)
 
     predictions_list.append(predictions.assign(model=model_name))
 
 st.markdown("### 2.2 Model comparison")
 plots.model_comparison(predictions_list)
+
+st.markdown("### 2.3 Processing comparison")
+if st.checkbox(
+    "Cross-validate the selected models on every processing variant",
+    key="compare-processing",
+):
+    plots.plot_processing_comparison(
+        pipeline.compare_processing(
+            loaded_data,
+            modelling_options["targets"],
+            modelling_options["models"],
+            modelling_options["n_splits"],
+            modelling_options["n_repeats"],
+            multioutput=modelling_options["multioutput"],
+            params=params,
+            fold_params=fold_params if cross_validation else None,
+        )
+    )
+
+ui.make_performance_panel(performance_records)
@@ -0,0 +1,125 @@
+import argparse
+
+from aqua import cache, data, pipeline
+from aqua._constant import (
+    aggregation_strategies,
+    available_models,
+    available_targets,
+    default_modelling_options,
+    default_processing_options,
+    evaluation_strategies,
+    feature_perturbations,
+    n_jobs,
+    normalization_strategies,
+)
+
+
+def parse_args(args: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m aqua",
+        description="Run the aqua analysis without the dashboard",
+    )
+    parser.add_argument("--data", default=data.raw_data_path, help="raw data (CSV)")
+    parser.add_argument("--output", default="./results", help="output directory")
+    parser.add_argument("--n-jobs", type=int, default=n_jobs)
+    parser.add_argument(
+        "--cache-dir",
+        default=cache.cache_dir,
+        help="persist the memoized stages, point the dashboard's AQUA_CACHE_DIR at "
+        "the same directory to reuse them",
+    )
+
+    processing = parser.add_argument_group("data processing options")
+    processing.add_argument(
+        "--normalization",
+        choices=normalization_strategies,
+        default=default_processing_options["normalization"],
+    )
+    processing.add_argument(
+        "--no-imbalance",
+        dest="imbalance",
+        action="store_false",
+        help="do not compute left - right imbalance",
+    )
+    processing.add_argument(
+        "--aggregation",
+        choices=aggregation_strategies,
+        default=default_processing_options["aggregation"],
+    )
+
+    modelling = parser.add_argument_group("modelling options")
+    modelling.add_argument(
+        "--targets",
+        nargs="+",
+        choices=available_targets,
+        default=default_modelling_options["targets"],
+    )
+    modelling.add_argument(
+        "--evaluation",
+        choices=evaluation_strategies,
+        default=default_modelling_options["evaluation"],
+    )
+    modelling.add_argument(
+        "--test-size", type=int, default=default_modelling_options["test_size"]
+    )
+    modelling.add_argument(
+        "--n-splits", type=int, default=default_modelling_options["n_splits"]
+    )
+    modelling.add_argument(
+        "--n-repeats", type=int, default=default_modelling_options["n_repeats"]
+    )
+    modelling.add_argument(
+        "--models",
+        nargs="+",
+        choices=available_models,
+        default=default_modelling_options["models"],
+    )
+    modelling.add_argument(
+        "--no-multioutput",
+        dest="multioutput",
+        action="store_false",
+        help="fit one estimator per target",
+    )
+    modelling.add_argument(
+        "--tune", action="store_true", help="tune hyperparameters first"
+    )
+    modelling.add_argument(
+        "--shap", action="store_true", help="also compute SHAP values"
+    )
+    modelling.add_argument(
+        "--compare-processing",
+        action="store_true",
+        help="also cross-validate every processing variant",
+    )
+    modelling.add_argument(
+        "--feature-perturbation",
+        choices=feature_perturbations,
+        default=default_modelling_options["feature_perturbation"],
+    )
+    return parser.parse_args(args)
+
+
+def main(args: list = None) -> None:
+    args = parse_args(args)
+    cache.cache_dir = args.cache_dir
+    processing_options = {
+        option: getattr(args, option) for option in default_processing_options
+    }
+    modelling_options = {
+        option: getattr(args, option) for option in default_modelling_options
+    }
+
+    results = pipeline.main(
+        processing_options,
+        modelling_options,
+        args.data,
+        args.output,
+        args.n_jobs,
+        args.shap,
+        args.compare_processing,
+    )
+    print(results["metrics"].to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,7 @@
+import importlib
+from collections.abc import Mapping
+
 import numpy as np
-from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
-from sklearn.ensemble._hist_gradient_boosting.gradient_boosting import (
-    HistGradientBoostingRegressor,
-)
-from sklearn.linear_model import LinearRegression, Lasso
-from xgboost import XGBRegressor
 
 random_seed = 7
 np.random.seed(random_seed)
@@ -35,16 +32,95 @@ available_targets = list(targets_description.keys())
 default_targets = ["BB", "EB mean height", "EB mean force"]
 
 normalization_strategies = ["None", "Weight", "Weight x Height", "IMC"]
+aggregation_strategies = ["F-score", "Mean"]
 forces_order = ["ADD", "ABD", "ER", "IR", "EXT", "FLEX"]
 
+
 # models --------------------
-models_functions = {
-    "Random Forest": RandomForestRegressor,
-    "XGBoost": XGBRegressor,
-    "Linear Regression": LinearRegression,
-    "Lasso Regression": Lasso,
-    "Gradient Tree Boosting": GradientBoostingRegressor,
-    "Histogram Gradient Boosting": HistGradientBoostingRegressor,
-}
+class LazyRegistry(Mapping):
+    # estimator classes are only imported when looked up for the first time
+    def __init__(self, paths: dict):
+        self.paths = paths
+        self.classes = {}
+
+    def __getitem__(self, name: str):
+        if name not in self.classes:
+            module, attribute = self.paths[name].rsplit(".", 1)
+            self.classes[name] = getattr(importlib.import_module(module), attribute)
+        return self.classes[name]
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+
+models_functions = LazyRegistry(
+    {
+        "Random Forest": "sklearn.ensemble.RandomForestRegressor",
+        "XGBoost": "xgboost.XGBRegressor",
+        "Linear Regression": "sklearn.linear_model.LinearRegression",
+        "Lasso Regression": "sklearn.linear_model.Lasso",
+        "Gradient Tree Boosting": "sklearn.ensemble.GradientBoostingRegressor",
+        "Histogram Gradient Boosting": "sklearn.ensemble.HistGradientBoostingRegressor",
+    }
+)
 available_models = list(models_functions.keys())
+search_spaces = {
+    "Random Forest": {
+        "n_estimators": [100, 200, 400],
+        "max_depth": [None, 3, 5, 8],
+        "min_samples_leaf": [1, 2, 4, 8],
+        "max_features": [1.0, 0.5, "sqrt"],
+    },
+    "XGBoost": {
+        "n_estimators": [100, 200, 400],
+        "max_depth": [2, 3, 4, 6],
+        "learning_rate": [0.01, 0.03, 0.1, 0.3],
+        "subsample": [0.6, 0.8, 1.0],
+        "colsample_bytree": [0.6, 0.8, 1.0],
+    },
+    "Linear Regression": {"fit_intercept": [True, False]},
+    "Lasso Regression": {"alpha": [0.001, 0.003, 0.01, 0.03, 0.1, 0.3, 1.0, 3.0]},
+    "Gradient Tree Boosting": {
+        "n_estimators": [100, 200, 400],
+        "learning_rate": [0.01, 0.05, 0.1, 0.2],
+        "max_depth": [2, 3, 4],
+        "subsample": [0.6, 0.8, 1.0],
+    },
+    "Histogram Gradient Boosting": {
+        "max_iter": [100, 200, 400],
+        "learning_rate": [0.01, 0.05, 0.1, 0.2],
+        "max_leaf_nodes": [7, 15, 31],
+        "min_samples_leaf": [5, 10, 20],
+    },
+}
+# models natively supporting 2-D targets
+multioutput_models = ["Random Forest", "Linear Regression", "Lasso Regression"]
 default_models = ["Random Forest", "Linear Regression"]
+feature_perturbations = ["tree_path_dependent", "interventional"]
+evaluation_strategies = ["Train/test split", "Cross-validation"]
+# "Auto" draws every point up to `plots.max_points` rows and bins above
+residual_modes = ["Auto", "Points", "Sample", "Bins"]
+bayes_inferences = ["Closed form", "Sampling"]
+# parallel workers used to fit the (model x target) grid, -1 uses all cores
+n_jobs = -1
+
+# options selected when the sidebar is first displayed, also used by the CLI
+default_processing_options = {
+    "normalization": normalization_strategies[0],
+    "imbalance": True,
+    "aggregation": aggregation_strategies[0],
+}
+default_modelling_options = {
+    "targets": default_targets,
+    "evaluation": evaluation_strategies[0],
+    "test_size": 20,
+    "n_splits": 5,
+    "n_repeats": 1,
+    "models": default_models,
+    "multioutput": True,
+    "tune": False,
+    "feature_perturbation": feature_perturbations[0],
+}
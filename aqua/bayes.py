@@ -0,0 +1,267 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from aqua import density
+from aqua._constant import random_seed
+from aqua.cache import fingerprint, memoize
+from aqua.profiling import timed
+
+trace_dir = os.environ.get("AQUA_TRACE_DIR", "./.aqua_cache/traces")
+# chains are sampled in parallel, one process per chain and core
+n_chains = 4
+interval_level = 0.9
+
+# full sampling requested from the fast mode runs in the background, one at a time
+_executor = ThreadPoolExecutor(max_workers=1)
+_refinements = {}
+_lock = threading.Lock()
+
+
+def standardize(X: pd.DataFrame, reference: pd.DataFrame = None) -> pd.DataFrame:
+    # with the mean and std of `reference` (e.g. the train split) when provided
+    reference = X if reference is None else reference
+    return (X - reference.mean()) / reference.std()
+
+
+def build_model(X: pd.DataFrame, y: pd.DataFrame):
+    # the model pm.GLM.from_formula builds for one target (flat intercept, wide
+    # normal coefficients, half-Cauchy noise), for all targets at once: the
+    # coefficients are a (feature, target) matrix
+    import pymc3 as pm
+
+    coords = {"feature": X.columns.to_list(), "target": y.columns.to_list()}
+    with pm.Model(coords=coords) as model:
+        intercept = pm.Flat("Intercept", dims="target")
+        beta = pm.Normal("beta", mu=0, tau=1.0e-6, dims=("feature", "target"))
+        sigma = pm.HalfCauchy("sd", beta=10, dims="target")
+        mu = intercept + pm.math.dot(X.to_numpy(dtype=float), beta)
+        pm.Normal("y", mu=mu, sigma=sigma, observed=y.to_numpy(dtype=float))
+    return model
+
+
+@timed
+@memoize
+def fit(
+    X: pd.DataFrame,
+    y: pd.DataFrame,
+    draws: int = 5000,
+    tune: int = 1000,
+    chains: int = n_chains,
+    path: str = trace_dir,
+):
+    # traces are stored as netCDF, keyed on the data (and thus the features and
+    # targets of the model) and the sampler settings
+    import arviz as az
+
+    key = fingerprint(build_model.__qualname__, X, y, draws, tune, chains, random_seed)
+    trace_path = os.path.join(path, f"{key}.nc")
+    if os.path.exists(trace_path):
+        return az.from_netcdf(trace_path)
+
+    import pymc3 as pm
+
+    with build_model(X, y):
+        trace = pm.sample(
+            draws,
+            tune=tune,
+            chains=chains,
+            cores=min(chains, os.cpu_count()),
+            random_seed=random_seed,
+            return_inferencedata=True,
+        )
+
+    os.makedirs(path, exist_ok=True)
+    tmp_path = f"{trace_path}.{os.getpid()}.tmp"
+    trace.to_netcdf(tmp_path)
+    os.replace(tmp_path, trace_path)
+    return trace
+
+
+def posterior_draws(trace, n_samples: int = None, seed: int = random_seed) -> dict:
+    # {"Intercept": (sample, target), "beta": (sample, feature, target),
+    # "sd": (sample, target)}, optionally subsampled
+    posterior = trace.posterior.stack(sample=("chain", "draw"))
+    draws = {
+        name: np.moveaxis(posterior[name].to_numpy(), -1, 0)
+        for name in ("Intercept", "beta", "sd")
+    }
+    n_draws = draws["sd"].shape[0]
+    if n_samples is not None and n_samples < n_draws:
+        index = np.random.default_rng(seed).choice(n_draws, n_samples, replace=False)
+        draws = {name: values[index] for name, values in draws.items()}
+    return draws
+
+
+def summarize(beta: np.ndarray, features: list, targets: list) -> pd.DataFrame:
+    # mean, sd and equal-tailed interval of (sample, feature, target) draws
+    tail = (1 - interval_level) / 2 * 100
+    lower, upper = np.percentile(beta, [tail, 100 - tail], axis=0)
+    return pd.DataFrame(
+        {
+            "feature": np.repeat(features, len(targets)),
+            "target": np.tile(targets, len(features)),
+            "mean": beta.mean(axis=0).ravel(),
+            "sd": beta.std(axis=0).ravel(),
+            "lower": lower.ravel(),
+            "upper": upper.ravel(),
+        }
+    )
+
+
+def coefficients(trace) -> pd.DataFrame:
+    posterior = trace.posterior
+    return summarize(
+        posterior_draws(trace)["beta"],
+        posterior["feature"].to_numpy().tolist(),
+        posterior["target"].to_numpy().tolist(),
+    )
+
+
+def sample_predictive(
+    draws: dict, X: pd.DataFrame, seed: int = random_seed
+) -> np.ndarray:
+    # (sample, row, target) draws of the posterior predictive in one array operation
+    mu = draws["Intercept"][:, np.newaxis] + X.to_numpy(dtype=float) @ draws["beta"]
+    noise = np.random.default_rng(seed).standard_normal(mu.shape)
+    return mu + draws["sd"][:, np.newaxis] * noise
+
+
+@timed
+def predictive_density(
+    draws: dict, X: pd.DataFrame, targets: list, grid_size: int = density.grid_size
+) -> pd.DataFrame:
+    # KDE of each posterior predictive sample, all samples of a target in one pass
+    return predictive_density_table(sample_predictive(draws, X), targets, grid_size)
+
+
+def predictive_density_table(
+    predicted: np.ndarray, targets: list, grid_size: int = density.grid_size
+) -> pd.DataFrame:
+    tables = []
+    n_samples = predicted.shape[0]
+    for i, target in enumerate(targets):
+        grid, densities = density.gaussian_kde(predicted[..., i], grid_size)
+        tables.append(
+            pd.DataFrame(
+                {
+                    "target": target,
+                    "sample": np.repeat(np.arange(n_samples), grid_size),
+                    "value": np.tile(grid, n_samples),
+                    "density": densities.ravel(),
+                }
+            )
+        )
+    return pd.concat(tables, ignore_index=True)
+
+
+def refine(X: pd.DataFrame, y: pd.DataFrame, **sample_kwargs) -> Future:
+    # full sampling in a background thread, `fit` caches the trace so that the next
+    # call once the future is done returns immediately
+    key = fingerprint(X, y, sample_kwargs)
+    with _lock:
+        if key not in _refinements:
+            _refinements[key] = _executor.submit(fit, X, y, **sample_kwargs)
+        return _refinements[key]
+
+
+# fast mode ------------------
+class ConjugatePosterior(NamedTuple):
+    # normal-inverse-gamma posterior of a linear regression per target, sharing the
+    # design matrix: beta | s2 ~ N(mean, s2 * covariance), s2 ~ IG(shape, scale)
+    features: list
+    targets: list
+    mean: np.ndarray
+    covariance: np.ndarray
+    shape: float
+    scale: np.ndarray
+
+
+@timed
+@memoize
+def conjugate_fit(
+    X: pd.DataFrame,
+    y: pd.DataFrame,
+    prior_variance: float = 1.0e6,
+    prior_shape: float = 1.0e-3,
+    prior_scale: float = 1.0e-3,
+) -> ConjugatePosterior:
+    # closed form counterpart of `build_model`: zero-mean wide normal priors on the
+    # intercept and the coefficients, all targets solved at once
+    design = np.column_stack([np.ones(X.shape[0]), X.to_numpy(dtype=float)])
+    Y = y.to_numpy(dtype=float)
+    precision = design.T @ design + np.eye(design.shape[1]) / prior_variance
+    covariance = np.linalg.inv(precision)
+    mean = covariance @ (design.T @ Y)
+
+    residuals = Y - design @ mean
+    penalty = np.sum(mean**2, axis=0) / prior_variance
+    return ConjugatePosterior(
+        features=["Intercept"] + X.columns.to_list(),
+        targets=y.columns.to_list(),
+        mean=mean,
+        covariance=covariance,
+        shape=prior_shape + X.shape[0] / 2,
+        scale=prior_scale + (np.sum(residuals**2, axis=0) + penalty) / 2,
+    )
+
+
+def conjugate_coefficients(posterior: ConjugatePosterior) -> pd.DataFrame:
+    # marginals of the coefficients are student-t with 2 * shape degrees of freedom
+    dof = 2 * posterior.shape
+    scale = np.sqrt(
+        np.outer(np.diag(posterior.covariance), posterior.scale / posterior.shape)
+    )
+    quantile = stats.t.ppf((1 + interval_level) / 2, dof)
+    mean = posterior.mean[1:]
+    scale = scale[1:]
+    return pd.DataFrame(
+        {
+            "feature": np.repeat(posterior.features[1:], len(posterior.targets)),
+            "target": np.tile(posterior.targets, len(posterior.features) - 1),
+            "mean": mean.ravel(),
+            "sd": (scale * np.sqrt(dof / (dof - 2))).ravel(),
+            "lower": (mean - quantile * scale).ravel(),
+            "upper": (mean + quantile * scale).ravel(),
+        }
+    )
+
+
+def conjugate_draws(
+    posterior: ConjugatePosterior, n_samples: int = 50, seed: int = random_seed
+) -> dict:
+    # exact posterior draws, same layout as `posterior_draws`
+    rng = np.random.default_rng(seed)
+    n_features, n_targets = posterior.mean.shape
+    variance = posterior.scale / rng.gamma(posterior.shape, size=(n_samples, n_targets))
+    noise = np.linalg.cholesky(posterior.covariance) @ rng.standard_normal(
+        (n_samples, n_features, n_targets)
+    )
+    beta = posterior.mean + noise * np.sqrt(variance)[:, np.newaxis]
+    return {"Intercept": beta[:, 0], "beta": beta[:, 1:], "sd": np.sqrt(variance)}
+
+
+def conjugate_predictive_interval(
+    posterior: ConjugatePosterior, X: pd.DataFrame
+) -> pd.DataFrame:
+    # predictive distributions are student-t, one row per (row, target)
+    design = np.column_stack([np.ones(X.shape[0]), X.to_numpy(dtype=float)])
+    location = design @ posterior.mean
+    leverage = np.einsum("ij,jk,ik->i", design, posterior.covariance, design)
+    scale = np.sqrt(np.outer(1 + leverage, posterior.scale / posterior.shape))
+    quantile = stats.t.ppf((1 + interval_level) / 2, 2 * posterior.shape)
+    n_targets = len(posterior.targets)
+    return pd.DataFrame(
+        {
+            "target": np.repeat(posterior.targets, X.shape[0]),
+            "predicted": location.ravel(order="F"),
+            "lower": (location - quantile * scale).ravel(order="F"),
+            "upper": (location + quantile * scale).ravel(order="F"),
+        },
+        index=np.tile(X.index, n_targets),
+    )
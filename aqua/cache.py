@@ -0,0 +1,263 @@
+import contextlib
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import sys
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+cache_maxsize = int(os.environ.get("AQUA_CACHE_MAXSIZE", 32))
+# estimated bytes held by all the memoized stores together, least recently used
+# values are evicted first whatever their store
+cache_maxbytes = int(os.environ.get("AQUA_CACHE_MAXBYTES", 2 * 1024**3))
+# the on-disk tier is only enabled when a directory is provided
+cache_dir = os.environ.get("AQUA_CACHE_DIR")
+
+_missing = object()
+_immutables = (str, bytes, int, float, bool, tuple, type(None))
+_lock = threading.Lock()
+# fingerprints of the values currently held by a memoized store, so that cached
+# results (e.g. fitted models) are hashed by their derivation key, not their content
+_fingerprints = {}
+_file_digests = {}
+# {key: (store, object ids)} of every value held in memory, in recency order
+_entries = OrderedDict()
+# {id: [number of entries holding it, bytes]} of the objects reachable from the held
+# values, an object shared by several values (e.g. an estimator behind the outputs
+# of a multi-output model) is only counted once
+_held = {}
+_total_bytes = 0
+
+
+def file_digest(path: str) -> str:
+    stat = os.stat(path)
+    signature = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    if signature not in _file_digests:
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        _file_digests[signature] = digest.hexdigest()
+    return _file_digests[signature]
+
+
+def fingerprint(*objects) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for obj in objects:
+        _update(digest, obj)
+    return digest.hexdigest()
+
+
+def _update(digest, obj) -> None:
+    if id(obj) in _fingerprints:
+        digest.update(_fingerprints[id(obj)].encode())
+    elif isinstance(obj, (pd.DataFrame, pd.Series)):
+        digest.update(type(obj).__name__.encode())
+        names = obj.columns if isinstance(obj, pd.DataFrame) else [obj.name]
+        digest.update(repr(list(names)).encode())
+        digest.update(pd.util.hash_pandas_object(obj, index=True).values.tobytes())
+    elif isinstance(obj, np.ndarray):
+        digest.update(f"{obj.dtype.str}{obj.shape}".encode())
+        digest.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, dict):
+        digest.update(b"dict")
+        for key in sorted(obj, key=repr):
+            _update(digest, key)
+            _update(digest, obj[key])
+    elif isinstance(obj, (list, tuple)):
+        digest.update(type(obj).__name__.encode())
+        for item in obj:
+            _update(digest, item)
+    elif obj is None or isinstance(obj, (str, int, float, bool)):
+        digest.update(repr(obj).encode())
+    else:
+        digest.update(pickle.dumps(obj))
+
+
+def _disk_path(key: str) -> Path:
+    return Path(cache_dir) / f"{key}.pkl"
+
+
+def _disk_load(key: str):
+    path = _disk_path(key)
+    if not path.exists():
+        return _missing
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return _missing
+
+
+def _disk_dump(key: str, value) -> None:
+    path = _disk_path(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def _sizes(value) -> dict:
+    # {id: bytes} of the objects reachable from `value`, nested objects included;
+    # estimators are sized by their arrays, extension types without a __dict__
+    # (e.g. sklearn trees) by the arrays of their state
+    sizes = {}
+    stack = [value]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in sizes:
+            continue
+        if isinstance(obj, (pd.DataFrame, pd.Series)):
+            sizes[id(obj)] = int(np.sum(obj.memory_usage(index=True)))
+            continue
+        if isinstance(obj, np.ndarray):
+            sizes[id(obj)] = obj.nbytes
+            continue
+        sizes[id(obj)] = sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif isinstance(obj, _immutables):
+            continue
+        elif hasattr(obj, "__dict__"):
+            stack.extend(vars(obj).values())
+        else:
+            with contextlib.suppress(Exception):
+                state = obj.__getstate__()
+                if isinstance(state, dict):
+                    sizes[id(obj)] += sum(
+                        array.nbytes
+                        for array in state.values()
+                        if isinstance(array, np.ndarray)
+                    )
+    return sizes
+
+
+def _hold(sizes: dict) -> None:
+    global _total_bytes
+    for object_id, nbytes in sizes.items():
+        if object_id in _held:
+            _held[object_id][0] += 1
+        else:
+            _held[object_id] = [1, nbytes]
+            _total_bytes += nbytes
+
+
+def _release(object_ids) -> None:
+    global _total_bytes
+    for object_id in object_ids:
+        held = _held[object_id]
+        held[0] -= 1
+        if not held[0]:
+            _total_bytes -= held[1]
+            del _held[object_id]
+
+
+def _evict(key: str) -> None:
+    store, object_ids = _entries.pop(key)
+    _release(object_ids)
+    _unregister(store.pop(key))
+
+
+def _register(value, key: str) -> None:
+    # nested values (e.g. the models of a {model_name: {target: model}} result) get
+    # their own derived fingerprint so that they can be passed around separately
+    if isinstance(value, _immutables):
+        return
+    _fingerprints[id(value)] = key
+    if isinstance(value, dict):
+        for item, nested in value.items():
+            _register(nested, fingerprint(key, item))
+
+
+def _unregister(value) -> None:
+    if isinstance(value, _immutables):
+        return
+    _fingerprints.pop(id(value), None)
+    if isinstance(value, dict):
+        for nested in value.values():
+            _unregister(nested)
+
+
+def clear() -> None:
+    # empties every memoized store, e.g. to time a cold run
+    with _lock:
+        for key in list(_entries):
+            _evict(key)
+
+
+def memoize(func=None, *, maxsize: int = None, files: tuple = (), ignore: tuple = ()):
+    # LRU store keyed on the arguments' content (`files` arguments are paths hashed
+    # by file content, `ignore` arguments such as the number of workers do not
+    # change the result and are left out of the key); cached values are shared and
+    # must not be mutated in place
+    if func is None:
+        return functools.partial(memoize, maxsize=maxsize, files=files, ignore=ignore)
+
+    signature = inspect.signature(func)
+    store = OrderedDict()
+    size = cache_maxsize if maxsize is None else maxsize
+    name = f"{func.__module__}.{func.__qualname__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = {
+            arg: file_digest(value) if arg in files else value
+            for arg, value in bound.arguments.items()
+            if arg not in ignore
+        }
+        key = fingerprint(name, arguments)
+
+        with _lock:
+            if key in store:
+                store.move_to_end(key)
+                _entries.move_to_end(key)
+                return store[key]
+
+        value = _disk_load(key) if cache_dir else _missing
+        if value is _missing:
+            value = func(*args, **kwargs)
+            if cache_dir:
+                _disk_dump(key, value)
+
+        with _lock:
+            if key in store:
+                _evict(key)
+            sizes = _sizes(value)
+            # values larger than the whole budget are returned but not kept
+            if (
+                sum(
+                    nbytes
+                    for object_id, nbytes in sizes.items()
+                    if object_id not in _held
+                )
+                > cache_maxbytes
+            ):
+                return value
+            store[key] = value
+            _entries[key] = (store, list(sizes))
+            _hold(sizes)
+            _register(value, key)
+            while len(store) > size:
+                _evict(next(iter(store)))
+            while _total_bytes > cache_maxbytes:
+                _evict(next(iter(_entries)))
+        return value
+
+    def cache_clear() -> None:
+        with _lock:
+            for key in list(store):
+                _evict(key)
+
+    wrapper.cache_clear = cache_clear
+    return wrapper
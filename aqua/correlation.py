@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+
+from aqua.cache import memoize
+
+
+@memoize(maxsize=256)
+def _rank(column: pd.Series) -> pd.Series:
+    return column.rank()
+
+
+@memoize(maxsize=64)
+def _prepare(block: pd.DataFrame) -> dict:
+    # columns shifted by their mean with missing values set to 0, and the mask of
+    # the observed values; the result is registered in the cache so that the
+    # statistics below are keyed on it without hashing the block again
+    complete = not block.isna().to_numpy().any()
+    values = np.nan_to_num(block.to_numpy(dtype=float) - block.mean().to_numpy())
+    return {
+        "values": values,
+        "mask": None if complete else block.notna().to_numpy(dtype=float),
+        "sums": values.sum(axis=0),
+        "squares": (values**2).sum(axis=0),
+    }
+
+
+@memoize(maxsize=64)
+def cross_stats(X: dict, Y: dict) -> dict:
+    # pairwise-complete sufficient statistics of every (column of X, column of Y)
+    # pair of two prepared blocks: count, sums, sums of squares and cross-products,
+    # missing values only drop the pairs they are part of
+    X_values, Y_values = X["values"], Y["values"]
+    if X["mask"] is None and Y["mask"] is None:
+        shape = (X_values.shape[1], Y_values.shape[1])
+        return {
+            "n": np.full(shape, float(X_values.shape[0])),
+            "x": np.broadcast_to(X["sums"][:, np.newaxis], shape),
+            "y": np.broadcast_to(Y["sums"], shape),
+            "xx": np.broadcast_to(X["squares"][:, np.newaxis], shape),
+            "yy": np.broadcast_to(Y["squares"], shape),
+            "xy": X_values.T @ Y_values,
+        }
+
+    X_mask = np.ones_like(X_values) if X["mask"] is None else X["mask"]
+    Y_mask = np.ones_like(Y_values) if Y["mask"] is None else Y["mask"]
+    return {
+        "n": X_mask.T @ Y_mask,
+        "x": X_values.T @ Y_mask,
+        "y": X_mask.T @ Y_values,
+        "xx": (X_values**2).T @ Y_mask,
+        "yy": X_mask.T @ Y_values**2,
+        "xy": X_values.T @ Y_values,
+    }
+
+
+def _correlation_block(stats: dict) -> np.ndarray:
+    n = stats["n"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        covariance = n * stats["xy"] - stats["x"] * stats["y"]
+        variance = (n * stats["xx"] - stats["x"] ** 2) * (
+            n * stats["yy"] - stats["y"] ** 2
+        )
+        correlation = np.clip(covariance / np.sqrt(variance), -1, 1)
+    correlation[n < 2] = np.nan
+    return correlation
+
+
+@memoize
+def correlation_matrix(blocks: list, method: str = "pearson") -> pd.DataFrame:
+    # correlations between the columns of all `blocks` (e.g. [variables, targets]),
+    # statistics are cached per pair of blocks so that selecting other targets only
+    # computes the cross-products involving the new target block
+    if method not in ("pearson", "spearman"):
+        raise ValueError(f"{method} is not a correlation method")
+    if method == "spearman":
+        if any(block.isna().to_numpy().any() for block in blocks):
+            # ranks of the pairwise-complete observations, as DataFrame.corr
+            return pd.concat(blocks, axis=1).corr(method)
+        # ranks are cached per column, a new target selection only ranks new columns
+        blocks = [
+            pd.DataFrame({column: _rank(block[column]) for column in block})
+            for block in blocks
+        ]
+
+    prepared = [_prepare(block) for block in blocks]
+    correlation = np.block(
+        [
+            [_correlation_block(cross_stats(left, right)) for right in prepared]
+            for left in prepared
+        ]
+    )
+    columns = [column for block in blocks for column in block]
+    return pd.DataFrame(correlation, index=columns, columns=columns)
+
+
+def half_matrix(correlation: pd.DataFrame) -> pd.DataFrame:
+    # upper triangle (diagonal included) in long format, without melting the matrix
+    rows, columns = np.triu_indices(correlation.shape[0])
+    labels = correlation.columns.to_numpy()
+    half = pd.DataFrame(
+        {
+            "index": labels[rows],
+            "variable": labels[columns],
+            "value": correlation.to_numpy()[rows, columns],
+        }
+    )
+    return half[np.isfinite(half["value"])]
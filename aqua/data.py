@@ -1,5 +1,158 @@
+import contextlib
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
 import pandas as pd
 
+from aqua._constant import available_targets
+from aqua.cache import memoize
+from aqua.profiling import timed
+
+raw_data_path = "./data/raw.csv"
+# stores written with another layout are converted again from the CSV
+store_version = 2
+_store_lock = threading.Lock()
+
+
+def _digest(path: str, n_bytes: int) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while n_bytes > 0:
+            block = f.read(min(n_bytes, 1 << 20))
+            if not block:
+                break
+            digest.update(block)
+            n_bytes -= len(block)
+    return digest.hexdigest()
+
+
+def _ends_with_newline(path: str, n_bytes: int) -> bool:
+    with open(path, "rb") as f:
+        f.seek(n_bytes - 1)
+        return f.read(1) == b"\n"
+
+
+def default_store_path(data_path: str) -> str:
+    directory, filename = os.path.split(data_path)
+    return os.path.join(directory, ".store", os.path.splitext(filename)[0])
+
+
+def _missing_path(store_path: str, filename: str) -> str:
+    return os.path.join(store_path, f"{os.path.splitext(filename)[0]}-missing.npy")
+
+
+def _write_column(store_path: str, key: str, i: int, values: np.ndarray) -> str:
+    # text columns are stored as fixed-width strings, their missing values in a
+    # separate mask so that they are not read back as the string "nan"
+    filename = f"{key}-{i}.npy"
+    if values.dtype == object:
+        missing = pd.isna(values)
+        values = np.where(missing, "", values).astype(str)
+        if missing.any():
+            np.save(_missing_path(store_path, filename), missing)
+    np.save(os.path.join(store_path, filename), values)
+    return filename
+
+
+def _read_column(store_path: str, filename: str, mmap_mode: str = None) -> np.ndarray:
+    values = np.load(os.path.join(store_path, filename), mmap_mode=mmap_mode)
+    missing_path = _missing_path(store_path, filename)
+    if os.path.exists(missing_path):
+        values = values.astype(object)
+        values[np.load(missing_path)] = np.nan
+    return values
+
+
+def update_store(data_path: str, store_path: str = None) -> dict:
+    # the CSV is converted once into one .npy file per column, a change of the
+    # source only triggers a conversion of the rows appended since the last one
+    store_path = store_path or default_store_path(data_path)
+    meta_path = os.path.join(store_path, "meta.json")
+    with _store_lock:
+        meta = None
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+
+        previous_files = set(meta["files"]) if meta else set()
+        if meta and meta.get("version") != store_version:
+            meta = None
+
+        stat = os.stat(data_path)
+        if (
+            meta
+            and meta["mtime_ns"] == stat.st_mtime_ns
+            and meta["size"] == stat.st_size
+        ):
+            return meta
+
+        digest = _digest(data_path, stat.st_size)
+        if meta and meta["digest"] == digest:
+            arrays = None
+        elif (
+            meta
+            and stat.st_size > meta["size"]
+            and _ends_with_newline(data_path, meta["size"])
+            and _digest(data_path, meta["size"]) == meta["digest"]
+        ):
+            with open(data_path, "rb") as f:
+                f.seek(meta["size"])
+                appended = pd.read_csv(f, header=None, names=meta["columns"])
+            arrays = [
+                np.concatenate(
+                    [
+                        _read_column(store_path, filename),
+                        appended[column].to_numpy(),
+                    ]
+                )
+                for column, filename in zip(meta["columns"], meta["files"])
+            ]
+        else:
+            raw = pd.read_csv(data_path)
+            meta = {"version": store_version, "columns": raw.columns.to_list()}
+            arrays = [raw[column].to_numpy() for column in raw]
+
+        os.makedirs(store_path, exist_ok=True)
+        if arrays is not None:
+            meta["files"] = [
+                _write_column(store_path, f"{digest}-v{store_version}", i, values)
+                for i, values in enumerate(arrays)
+            ]
+            meta["n_rows"] = len(arrays[0]) if arrays else 0
+            # readers holding a memory map on a removed file keep their mapping
+            for filename in previous_files - set(meta["files"]):
+                for path in (
+                    os.path.join(store_path, filename),
+                    _missing_path(store_path, filename),
+                ):
+                    with contextlib.suppress(OSError):
+                        os.remove(path)
+        meta.update(digest=digest, mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+
+        tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+    return meta
+
 
-def load_raw_data(data_path: str = "./data/raw.csv") -> pd.DataFrame:
-    return pd.read_csv(data_path)
+@timed
+@memoize(files=("data_path",))
+def load_raw_data(
+    data_path: str = raw_data_path, targets: list = None, store_path: str = None
+) -> pd.DataFrame:
+    # columns are memory-mapped from the store, only the selected `targets` are
+    # loaded when provided
+    store_path = store_path or default_store_path(data_path)
+    meta = update_store(data_path, store_path)
+    return pd.DataFrame(
+        {
+            column: _read_column(store_path, filename, mmap_mode="r")
+            for column, filename in zip(meta["columns"], meta["files"])
+            if targets is None or column not in available_targets or column in targets
+        },
+        copy=False,
+    )
@@ -0,0 +1,138 @@
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from aqua._constant import random_seed
+from aqua.cache import memoize
+
+grid_size = 100
+n_bins = 40
+
+
+def scott_bandwidth(x: np.ndarray) -> np.ndarray:
+    # same normal reference rule as vega's `density` transform, along the last axis
+    n = x.shape[-1]
+    std = x.std(axis=-1, ddof=1) if n > 1 else np.zeros(x.shape[:-1])
+    q3, q1 = np.percentile(x, [75, 25], axis=-1)
+    spread = np.minimum(std, (q3 - q1) / 1.34)
+    for fallback in (std, np.abs(x.mean(axis=-1)), 1.0):
+        spread = np.where(spread > 0, spread, fallback)
+    return 1.06 * spread * n**-0.2
+
+
+def gaussian_kde(
+    x: np.ndarray, grid_size: int = grid_size, cut: float = 3
+) -> Tuple[np.ndarray, np.ndarray]:
+    # the samples are linearly binned on the grid, then convolved with the gaussian
+    # kernel through FFT, so the cost only depends on the grid size after binning;
+    # a 2-D `x` gets one density per row in a single pass, on a grid shared by all
+    # rows
+    samples = np.atleast_2d(x)
+    n_rows, n = samples.shape
+    bandwidth = scott_bandwidth(samples)
+    margin = cut * bandwidth.max()
+    grid = np.linspace(samples.min() - margin, samples.max() + margin, grid_size)
+    delta = grid[1] - grid[0]
+
+    position = (samples - grid[0]) / delta
+    left = np.clip(np.floor(position).astype(int), 0, grid_size - 2)
+    weight = (position - left).ravel()
+    # bins of each row are offset so that one bincount covers all rows
+    left = (left + grid_size * np.arange(n_rows)[:, np.newaxis]).ravel()
+    counts = np.bincount(left, 1 - weight, n_rows * grid_size) + np.bincount(
+        left + 1, weight, n_rows * grid_size
+    )
+
+    offsets = np.arange(-grid_size + 1, grid_size) * delta
+    bandwidth = bandwidth[:, np.newaxis]
+    kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2) / (
+        bandwidth * np.sqrt(2 * np.pi)
+    )
+    n_fft = 1 << int(np.ceil(np.log2(grid_size + kernel.shape[1] - 1)))
+    convolved = np.fft.irfft(
+        np.fft.rfft(counts.reshape(n_rows, grid_size), n_fft)
+        * np.fft.rfft(kernel, n_fft),
+        n_fft,
+    )
+    density = np.clip(convolved[:, grid_size - 1 : 2 * grid_size - 1] / n, 0, None)
+    return grid, density if np.ndim(x) > 1 else density[0]
+
+
+@memoize
+def density_table(
+    data: pd.DataFrame,
+    groupby: list = None,
+    value: str = "value",
+    grid_size: int = grid_size,
+) -> pd.DataFrame:
+    # one row per grid point and group, the mean and quartiles of each group are
+    # stored on its first row (flagged by `summary`)
+    if groupby is None:
+        groupby = ["variable"]
+
+    tables = []
+    for keys, group in data.groupby(groupby, sort=False)[value]:
+        x = group.to_numpy(dtype=float)
+        x = x[np.isfinite(x)]
+        if x.size == 0:
+            continue
+        grid, density = gaussian_kde(x, grid_size)
+        q1, q3 = np.percentile(x, [25, 75])
+        summary = np.zeros(grid_size, dtype=bool)
+        summary[0] = True
+
+        tables.append(
+            pd.DataFrame(
+                {
+                    **dict(zip(groupby, keys)),
+                    value: grid,
+                    "density": density,
+                    "summary": summary,
+                    "mean": x.mean(),
+                    "q1": q1,
+                    "q3": q3,
+                }
+            )
+        )
+    return pd.concat(tables, ignore_index=True)
+
+
+@memoize
+def histogram_table(
+    data: pd.DataFrame, x: str, y: str, groupby: list, n_bins: int = n_bins
+) -> pd.DataFrame:
+    # 2-D histogram of `x` and `y` per group on edges shared by all groups, one row
+    # per non-empty bin
+    x_edges = np.histogram_bin_edges(data[x].to_numpy(dtype=float), n_bins)
+    y_edges = np.histogram_bin_edges(data[y].to_numpy(dtype=float), n_bins)
+    x_bins, y_bins = np.meshgrid(np.arange(n_bins), np.arange(n_bins), indexing="ij")
+
+    tables = []
+    for keys, group in data.groupby(groupby, sort=False):
+        counts, _, _ = np.histogram2d(group[x], group[y], [x_edges, y_edges])
+        filled = counts > 0
+        tables.append(
+            pd.DataFrame(
+                {
+                    **dict(zip(groupby, keys)),
+                    f"{x}_start": x_edges[x_bins[filled]],
+                    f"{x}_end": x_edges[x_bins[filled] + 1],
+                    f"{y}_start": y_edges[y_bins[filled]],
+                    f"{y}_end": y_edges[y_bins[filled] + 1],
+                    "count": counts[filled].astype(int),
+                }
+            )
+        )
+    return pd.concat(tables, ignore_index=True)
+
+
+def sample_table(
+    data: pd.DataFrame, groupby: list, n_rows: int, seed: int = random_seed
+) -> pd.DataFrame:
+    # stratified sample of about `n_rows` rows keeping the share of every group
+    if data.shape[0] <= n_rows:
+        return data
+    return data.groupby(groupby, sort=False).sample(
+        frac=n_rows / data.shape[0], random_state=seed
+    )
@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+from aqua._constant import random_seed
+from aqua.cache import memoize
+from aqua.profiling import timed
+
+metric_names = ["MAE", "MAPE", "RMSE", "R2"]
+n_resamples = 2000
+confidence_level = 0.95
+# upper bound on the elements of a resampled index matrix, larger groups resample
+# in several blocks
+max_resampled = 10**7
+
+
+def scores(real: np.ndarray, predicted: np.ndarray) -> np.ndarray:
+    # (metric, ...) scores along the last axis, so that a (resample, row) matrix
+    # is scored in one operation
+    error = predicted - real
+    squared = np.sum(error**2, axis=-1)
+    total = np.sum((real - real.mean(axis=-1, keepdims=True)) ** 2, axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.stack(
+            [
+                np.mean(np.abs(error), axis=-1),
+                np.mean(np.abs(error / real), axis=-1) * 100,
+                np.sqrt(squared / real.shape[-1]),
+                1 - squared / total,
+            ]
+        )
+
+
+def bootstrap(
+    real: np.ndarray,
+    predicted: np.ndarray,
+    n_resamples: int = n_resamples,
+    seed: int = random_seed,
+) -> np.ndarray:
+    # (metric, resample) scores of rows resampled with replacement, 2-D (row, repeat)
+    # arrays resample a row with all its repeated predictions
+    rng = np.random.default_rng(seed)
+    n_rows = real.shape[0]
+    block = max(max_resampled // max(real.size, 1), 1)
+    resampled = []
+    for start in range(0, n_resamples, block):
+        index = rng.integers(0, n_rows, size=(min(block, n_resamples - start), n_rows))
+        resampled.append(
+            scores(
+                real[index].reshape(index.shape[0], -1),
+                predicted[index].reshape(index.shape[0], -1),
+            )
+        )
+    return np.concatenate(resampled, axis=1)
+
+
+def _row_blocks(group: pd.DataFrame) -> tuple:
+    # (row, repeat) real and predicted values, rows being identified by the index:
+    # under repeated k-fold a row is predicted once per repeat and these predictions
+    # are not independent observations
+    real = group["real"].to_numpy(dtype=float)
+    predicted = group["predicted"].to_numpy(dtype=float)
+    if group.index.is_unique:
+        return real[:, np.newaxis], predicted[:, np.newaxis]
+
+    rows, inverse, counts = np.unique(
+        group.index.to_numpy(), return_inverse=True, return_counts=True
+    )
+    if np.all(counts == counts[0]):
+        order = np.argsort(inverse, kind="stable")
+        return (
+            real[order].reshape(rows.size, -1),
+            predicted[order].reshape(rows.size, -1),
+        )
+    # uneven repeats: each row contributes the mean of its predictions
+    return (
+        (np.bincount(inverse, real) / counts)[:, np.newaxis],
+        (np.bincount(inverse, predicted) / counts)[:, np.newaxis],
+    )
+
+
+@timed
+@memoize
+def compute_metrics(
+    predictions: pd.DataFrame,
+    groupby: list = None,
+    n_resamples: int = n_resamples,
+    level: float = confidence_level,
+) -> pd.DataFrame:
+    # one row per group and metric with its bootstrap percentile interval
+    if groupby is None:
+        groupby = ["model", "target"]
+    tail = (1 - level) / 2 * 100
+
+    tables = []
+    for keys, group in predictions.groupby(groupby, sort=False):
+        real = group["real"].to_numpy(dtype=float)
+        predicted = group["predicted"].to_numpy(dtype=float)
+        resampled = bootstrap(*_row_blocks(group), n_resamples)
+        lower, upper = np.nanpercentile(resampled, [tail, 100 - tail], axis=1)
+        tables.append(
+            pd.DataFrame(
+                {
+                    **dict(zip(groupby, keys)),
+                    "metric": metric_names,
+                    "value": scores(real, predicted),
+                    "lower": lower,
+                    "upper": upper,
+                }
+            )
+        )
+    return pd.concat(tables, ignore_index=True)
@@ -1,49 +1,511 @@
 from typing import Tuple
 
+import numpy as np
 import pandas as pd
-import shap
-from sklearn import model_selection
+from joblib import Parallel, delayed, effective_n_jobs
 
-from aqua._constant import available_targets, models_functions, random_seed
+from aqua._constant import (
+    available_targets,
+    models_functions,
+    multioutput_models,
+    n_jobs,
+    random_seed,
+)
+from aqua.cache import memoize
+from aqua.profiling import timed
+
+# upper bound on the rows of a stacked permuted matrix predicted in one call
+max_stacked_rows = 10**6
 
 
 def variables_targets_split(
     data: pd.DataFrame, targets: list
 ) -> Tuple[pd.DataFrame, pd.DataFrame]:
-    return data[targets], data.drop(available_targets, axis=1)
+    return data[targets], data.drop(available_targets, axis=1, errors="ignore")
 
 
 def train_test_split(
     variables: pd.DataFrame, targets: pd.DataFrame, test_size: int
 ) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    # sklearn is only imported once the modelling starts to speed up the first page
+    from sklearn import model_selection
+
     return model_selection.train_test_split(
         variables, targets, test_size=test_size / 100, random_state=random_seed
     )
 
 
-def train_model(X_train: pd.DataFrame, y_train: pd.DataFrame, model_name: str):
+def make_model(model_name: str, params: dict = None):
     model_param = {"random": {"random_state": random_seed}, "regression": {}}
+    return models_functions[model_name](
+        **model_param["regression" if "Regression" in model_name else "random"],
+        **(params or {}),
+    )
+
+
+class TargetOutput:
+    # one target of an estimator fitted jointly on several targets
+    def __init__(self, estimator, index: int):
+        self.estimator = estimator
+        self.index = index
+
+    def predict(self, X) -> np.ndarray:
+        return _predict_2d(self.estimator, X)[:, self.index]
+
+
+def _predict_2d(estimator, X) -> np.ndarray:
+    return np.reshape(estimator.predict(X), (X.shape[0], -1))
+
+
+def _fit(X_train: pd.DataFrame, y_train: pd.DataFrame, model_name: str, params: dict):
+    if isinstance(y_train, pd.DataFrame) and y_train.shape[1] == 1:
+        y_train = y_train.iloc[:, 0]
+    return make_model(model_name, params).fit(X_train, y_train)
+
+
+@timed
+@memoize(ignore=("n_jobs",))
+def train_models(
+    X_train: pd.DataFrame,
+    y_train: pd.DataFrame,
+    model_names: list,
+    n_jobs: int = n_jobs,
+    multioutput: bool = True,
+    params: dict = None,
+) -> dict:
+    return _train_models(X_train, y_train, model_names, n_jobs, multioutput, params)
+
+
+def _train_models(
+    X_train: pd.DataFrame,
+    y_train: pd.DataFrame,
+    model_names: list,
+    n_jobs: int = n_jobs,
+    multioutput: bool = True,
+    params: dict = None,
+) -> dict:
+    # models natively supporting 2-D targets are fitted once on all targets,
+    # `params` optionally maps model names to tuned hyperparameters
+    params = params or {}
+    grid = []
+    for model_name in model_names:
+        if multioutput and model_name in multioutput_models:
+            grid.append((model_name, y_train.columns.to_list()))
+        else:
+            grid.extend((model_name, [target]) for target in y_train)
+    fitted = Parallel(n_jobs=n_jobs)(
+        delayed(_fit)(X_train, y_train[targets], model_name, params.get(model_name))
+        for model_name, targets in grid
+    )
+
+    models = {model_name: {} for model_name in model_names}
+    for (model_name, targets), model in zip(grid, fitted):
+        for index, target in enumerate(targets):
+            models[model_name][target] = (
+                TargetOutput(model, index) if len(targets) > 1 else model
+            )
+    return models
+
+
+def predict_targets(X: pd.DataFrame, model: dict) -> pd.DataFrame:
+    # jointly fitted estimators are only evaluated once for all their targets
+    outputs = {}
+    predicted = {}
+    for target, estimator in model.items():
+        if isinstance(estimator, TargetOutput):
+            key = id(estimator.estimator)
+            if key not in outputs:
+                outputs[key] = _predict_2d(estimator.estimator, X)
+            predicted[target] = outputs[key][:, estimator.index]
+        else:
+            predicted[target] = estimator.predict(X)
+    return pd.DataFrame(predicted, index=X.index)
+
+
+@timed
+@memoize
+def predict(X: pd.DataFrame, y: pd.DataFrame, model: dict) -> pd.DataFrame:
+    targets = y.columns.to_list()
+    predicted = predict_targets(X, {target: model[target] for target in targets})
+    return pd.DataFrame(
+        {
+            "target": np.repeat(targets, X.shape[0]),
+            "real": y[targets].to_numpy().ravel(order="F"),
+            "predicted": predicted[targets].to_numpy().ravel(order="F"),
+        },
+        index=np.tile(X.index, len(targets)),
+    )
+
+
+def _fit_predict_fold(
+    X: np.ndarray,
+    Y: np.ndarray,
+    train_index: np.ndarray,
+    test_index: np.ndarray,
+    model_name: str,
+    multioutput: bool,
+    params: dict = None,
+) -> np.ndarray:
+    X_train, Y_train = X[train_index], Y[train_index]
+    if multioutput and model_name in multioutput_models:
+        y_train = Y_train if Y.shape[1] > 1 else Y_train[:, 0]
+        model = make_model(model_name, params).fit(X_train, y_train)
+        return _predict_2d(model, X[test_index])
+    return np.column_stack(
+        [
+            make_model(model_name, params)
+            .fit(X_train, Y_train[:, i])
+            .predict(X[test_index])
+            for i in range(Y.shape[1])
+        ]
+    )
+
+
+def cv_folds(n_rows: int, n_splits: int = 5, n_repeats: int = 1) -> list:
+    # (train, test) row indices of the repeated k-fold shared by the evaluation and
+    # the hyperparameter search nested in it
+    from sklearn import model_selection
+
+    return list(
+        model_selection.RepeatedKFold(
+            n_splits=n_splits, n_repeats=n_repeats, random_state=random_seed
+        ).split(np.arange(n_rows))
+    )
+
+
+def _evaluate_fold(
+    X: np.ndarray,
+    Y: np.ndarray,
+    train_index: np.ndarray,
+    test_index: np.ndarray,
+    model_name: str,
+    multioutput: bool,
+    params: dict,
+    columns: list,
+    targets: list,
+    n_permutations: int,
+) -> tuple:
+    # predictions of the held-out rows and, with `n_permutations`, the (feature,
+    # permutation, target) increase of their MAE when a variable is shuffled, both
+    # from the same fitted model
+    X, Y = pd.DataFrame(X, columns=columns), pd.DataFrame(Y, columns=targets)
+    model = _train_models(
+        X.iloc[train_index],
+        Y.iloc[train_index],
+        [model_name],
+        1,
+        multioutput,
+        {model_name: params},
+    )[model_name]
+    X_test, Y_test = X.iloc[test_index], Y.iloc[test_index]
+    increase = (
+        _permutation_increase(X_test, Y_test, model, n_permutations, 1)
+        if n_permutations
+        else None
+    )
+    return predict_targets(X_test, model).to_numpy(), increase
+
+
+@memoize(ignore=("n_jobs",))
+def _cross_validate(
+    variables: pd.DataFrame,
+    targets: pd.DataFrame,
+    model_names: list,
+    n_splits: int = 5,
+    n_repeats: int = 1,
+    n_jobs: int = n_jobs,
+    multioutput: bool = True,
+    params: dict = None,
+    fold_params: list = None,
+    n_permutations: int = 5,
+) -> dict:
+    # `fold_params` holds one {model_name: params} per fold, tuned on the training
+    # rows of that fold only, and takes precedence over `params`
+    fold_params = fold_params or [params or {}] * (n_splits * n_repeats)
+    # folds only carry row indices into arrays converted once, which joblib shares
+    # with the workers instead of copying a DataFrame per fold
+    X = variables.to_numpy(dtype=float)
+    Y = targets.to_numpy(dtype=float)
+    columns, target_names = variables.columns.to_list(), targets.columns.to_list()
+    folds = cv_folds(X.shape[0], n_splits, n_repeats)
+    offsets = np.cumsum([0] + [len(test) for _, test in folds])
+    grid = [
+        (model_name, train, test, slice(start, stop), fold_params[i].get(model_name))
+        for model_name in model_names
+        for i, ((train, test), start, stop) in enumerate(
+            zip(folds, offsets[:-1], offsets[1:])
+        )
+    ]
+
+    n_rows = offsets[-1]
+    index = np.concatenate([test for _, test in folds])
+    fold_id = np.repeat(np.arange(len(folds)), np.diff(offsets))
+    predicted = {
+        model_name: np.empty((n_rows, Y.shape[1])) for model_name in model_names
+    }
+    increases = {model_name: [] for model_name in model_names}
+
+    # predictions are written into the output arrays as the folds complete
+    results = Parallel(n_jobs=n_jobs, return_as="generator")(
+        delayed(_evaluate_fold)(
+            X,
+            Y,
+            train,
+            test,
+            model_name,
+            multioutput,
+            params,
+            columns,
+            target_names,
+            n_permutations,
+        )
+        for model_name, train, test, _, params in grid
+    )
+    for (model_name, _, _, rows, _), (fold_predictions, increase) in zip(grid, results):
+        predicted[model_name][rows] = fold_predictions
+        increases[model_name].append(increase)
+
+    n_targets = Y.shape[1]
     return {
-        target: models_functions[model_name](
-            **model_param["regression" if "Regression" in model_name else "random"]
-        ).fit(X_train, y_train[target])
-        for target in y_train
+        "predictions": {
+            model_name: pd.DataFrame(
+                {
+                    "fold": np.tile(fold_id, n_targets),
+                    "target": np.repeat(target_names, n_rows),
+                    "real": Y[index].ravel(order="F"),
+                    "predicted": predicted[model_name].ravel(order="F"),
+                },
+                index=np.tile(targets.index[index], n_targets),
+            )
+            for model_name in model_names
+        },
+        # pooled over folds, as many permutations per variable as folds times
+        # `n_permutations`
+        "importance": (
+            {
+                model_name: _importance_table(
+                    columns, target_names, np.concatenate(increases[model_name], axis=1)
+                )
+                for model_name in model_names
+            }
+            if n_permutations
+            else {}
+        ),
     }
 
 
-def predict(X: pd.DataFrame, y: pd.DataFrame, model: dict,) -> pd.DataFrame:
-    return pd.concat(
-        [
+@timed
+def cross_validate(
+    variables: pd.DataFrame,
+    targets: pd.DataFrame,
+    model_names: list,
+    n_splits: int = 5,
+    n_repeats: int = 1,
+    n_jobs: int = n_jobs,
+    multioutput: bool = True,
+    params: dict = None,
+    fold_params: list = None,
+    n_permutations: int = 5,
+) -> dict:
+    # {model_name: held-out predictions}, the permutation importance of the same
+    # fold models is computed along (see `cv_permutation_importance`)
+    return _cross_validate(
+        variables,
+        targets,
+        model_names,
+        n_splits,
+        n_repeats,
+        n_jobs,
+        multioutput,
+        params,
+        fold_params,
+        n_permutations,
+    )["predictions"]
+
+
+@timed
+def cv_permutation_importance(
+    variables: pd.DataFrame,
+    targets: pd.DataFrame,
+    model_names: list,
+    n_splits: int = 5,
+    n_repeats: int = 1,
+    n_jobs: int = n_jobs,
+    multioutput: bool = True,
+    params: dict = None,
+    fold_params: list = None,
+    n_permutations: int = 5,
+) -> dict:
+    # {model_name: permutation importance} on the held-out rows of each fold, with
+    # the models `cross_validate` fitted on the training rows of that fold, so that
+    # overfitted models are not credited with in-sample importances
+    return _cross_validate(
+        variables,
+        targets,
+        model_names,
+        n_splits,
+        n_repeats,
+        n_jobs,
+        multioutput,
+        params,
+        fold_params,
+        n_permutations,
+    )["importance"]
+
+
+def _tree_shap_values(
+    estimator, X: pd.DataFrame, feature_perturbation: str, background_size: int
+) -> np.ndarray:
+    # path-dependent explanations use the training cover stored in the trees and
+    # need no background dataset, interventional ones use a capped sample of X
+    import shap
+
+    background = (
+        None
+        if feature_perturbation == "tree_path_dependent"
+        else shap.sample(X, min(background_size, X.shape[0]), random_state=random_seed)
+    )
+    values = shap.TreeExplainer(
+        estimator, data=background, feature_perturbation=feature_perturbation
+    ).shap_values(X, check_additivity=False)
+    # older shap versions return one array per output
+    if isinstance(values, list):
+        values = np.stack(values, axis=-1)
+    return np.reshape(values, X.shape + (-1,))
+
+
+@timed
+@memoize
+def get_shap_values(
+    X: pd.DataFrame,
+    model: dict,
+    feature_perturbation: str = "tree_path_dependent",
+    background_size: int = 100,
+) -> dict:
+    # jointly fitted estimators are explained once for all their targets
+    outputs = {}
+    shap_values = {}
+    for target, estimator in model.items():
+        if isinstance(estimator, TargetOutput):
+            key = id(estimator.estimator)
+            if key not in outputs:
+                outputs[key] = _tree_shap_values(
+                    estimator.estimator, X, feature_perturbation, background_size
+                )
+            values = outputs[key][..., estimator.index]
+        else:
+            values = _tree_shap_values(
+                estimator, X, feature_perturbation, background_size
+            )[..., 0]
+        shap_values[target] = pd.DataFrame(values, columns=X.columns, index=X.index)
+    return shap_values
+
+
+def _permuted_errors(
+    model: dict,
+    X: np.ndarray,
+    Y: np.ndarray,
+    columns: list,
+    features: np.ndarray,
+    permutations: np.ndarray,
+) -> np.ndarray:
+    # copies of X with one column permuted, stacked for a single predict call;
+    # returns the MAE of every (feature, repeat, target)
+    n_repeats, n_rows = permutations.shape[1:]
+    stacked = np.broadcast_to(X, (len(features), n_repeats) + X.shape).copy()
+    for i, feature in enumerate(features):
+        stacked[i, ..., feature] = X[permutations[i], feature]
+    predicted = predict_targets(
+        pd.DataFrame(stacked.reshape(-1, X.shape[1]), columns=columns), model
+    ).to_numpy()
+    predicted = predicted.reshape(len(features), n_repeats, n_rows, -1)
+    return np.abs(predicted - Y).mean(axis=2)
+
+
+def _permutation_increase(
+    X: pd.DataFrame, y: pd.DataFrame, model: dict, n_repeats: int, n_jobs: int
+) -> np.ndarray:
+    # (feature, repeat, target) increase of the MAE when a variable is shuffled,
+    # the variables are split into chunks evaluated in parallel
+    model = {target: model[target] for target in y}
+    X_array, Y = X.to_numpy(dtype=float), y.to_numpy(dtype=float)
+    n_rows, n_features = X_array.shape
+    permutations = np.argsort(
+        np.random.default_rng(random_seed).random((n_features, n_repeats, n_rows)),
+        axis=-1,
+    )
+    baseline = np.abs(predict_targets(X, model).to_numpy() - Y).mean(axis=0)
+
+    n_chunks = max(
+        min(effective_n_jobs(n_jobs), n_features),
+        -(-n_features * n_repeats * n_rows // max_stacked_rows),
+    )
+    chunks = np.array_split(np.arange(n_features), min(n_chunks, n_features))
+    errors = np.concatenate(
+        Parallel(n_jobs=n_jobs)(
+            delayed(_permuted_errors)(
+                model, X_array, Y, X.columns, chunk, permutations[chunk]
+            )
+            for chunk in chunks
+        )
+    )
+    return errors - baseline
+
+
+def _importance_table(
+    variables: list, targets: list, increase: np.ndarray
+) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "variable": np.repeat(variables, len(targets)),
+            "target": np.tile(targets, len(variables)),
+            "importance": increase.mean(axis=1).ravel(),
+            "std": increase.std(axis=1).ravel(),
+        }
+    )
+
+
+@timed
+@memoize(ignore=("n_jobs",))
+def permutation_importance(
+    X: pd.DataFrame,
+    y: pd.DataFrame,
+    model: dict,
+    n_repeats: int = 5,
+    n_jobs: int = n_jobs,
+) -> pd.DataFrame:
+    increase = _permutation_increase(X, y, model, n_repeats, n_jobs)
+    return _importance_table(X.columns.to_list(), y.columns.to_list(), increase)
+
+
+@timed
+@memoize
+def coefficient_path(
+    X: pd.DataFrame, y: pd.DataFrame, n_alphas: int = 50, eps: float = 1e-3
+) -> pd.DataFrame:
+    # lasso coefficients of the standardized variables along a decreasing penalty,
+    # one path per target
+    from sklearn.linear_model import lasso_path
+
+    X_array = ((X - X.mean()) / X.std()).to_numpy(dtype=float)
+    paths = []
+    for target in y:
+        y_array = y[target].to_numpy(dtype=float)
+        y_array = y_array - y_array.mean()
+        alpha_max = np.abs(X_array.T @ y_array).max() / X_array.shape[0]
+        alphas = np.geomspace(alpha_max, alpha_max * eps, n_alphas)
+        alphas, coefs, _ = lasso_path(X_array, y_array, alphas=alphas)
+        paths.append(
             pd.DataFrame(
                 {
                     "target": target,
-                    "real": y[target],
-                    "predicted": model[target].predict(X),
+                    "alpha": np.tile(alphas, X.shape[1]),
+                    "variable": np.repeat(X.columns.to_list(), len(alphas)),
+                    "coefficient": coefs.ravel(),
                 }
             )
-            for target in y
-        ]
-    )
+        )
+    return pd.concat(paths, ignore_index=True)
 
 
 def evaluation(predictions: pd.DataFrame) -> pd.DataFrame:
@@ -0,0 +1,286 @@
+import json
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+
+from aqua import data, metrics, ml, processing, profiling, registry, tuning
+from aqua._constant import (
+    default_modelling_options,
+    default_processing_options,
+    n_jobs,
+)
+from aqua.cache import memoize
+from aqua.profiling import timed
+
+
+@timed
+def run(
+    processing_options: dict = None,
+    modelling_options: dict = None,
+    data_path: str = data.raw_data_path,
+    n_jobs: int = n_jobs,
+    shap: bool = False,
+    registry_path: str = registry.registry_path,
+) -> dict:
+    # same memoized stages and arguments as app.py, so that a run sharing its disk
+    # cache (AQUA_CACHE_DIR) with the dashboard leaves it only cache hits
+    processing_options = {**default_processing_options, **(processing_options or {})}
+    modelling_options = {**default_modelling_options, **(modelling_options or {})}
+
+    raw_data = data.load_raw_data(data_path, targets=modelling_options["targets"]).pipe(
+        processing.process_force_data, processing_options
+    )
+    targets, variables = ml.variables_targets_split(
+        raw_data, modelling_options["targets"]
+    )
+
+    cross_validation = modelling_options["evaluation"] == "Cross-validation"
+    if cross_validation:
+        X_train, y_train = variables, targets
+    else:
+        X_train, X_test, y_train, y_test = ml.train_test_split(
+            variables, targets, modelling_options["test_size"]
+        )
+
+    params = (
+        tuning.tune_models(
+            X_train,
+            y_train,
+            modelling_options["models"],
+            n_jobs=n_jobs,
+            multioutput=modelling_options["multioutput"],
+        )
+        if modelling_options["tune"]
+        else None
+    )
+
+    if cross_validation:
+        fold_params = (
+            tuning.tune_folds(
+                variables,
+                targets,
+                modelling_options["models"],
+                modelling_options["n_splits"],
+                modelling_options["n_repeats"],
+                n_jobs=n_jobs,
+                multioutput=modelling_options["multioutput"],
+            )
+            if modelling_options["tune"]
+            else None
+        )
+        cv_predictions = ml.cross_validate(
+            variables,
+            targets,
+            modelling_options["models"],
+            modelling_options["n_splits"],
+            modelling_options["n_repeats"],
+            n_jobs=n_jobs,
+            multioutput=modelling_options["multioutput"],
+            params=params,
+            fold_params=fold_params,
+        )
+
+    models = registry.train_models(
+        X_train,
+        y_train,
+        modelling_options["models"],
+        processing_options,
+        data_path,
+        n_jobs=n_jobs,
+        multioutput=modelling_options["multioutput"],
+        params=params,
+        path=registry_path,
+    )
+
+    # measured on held-out rows, by the fold models under cross-validation
+    importance = (
+        ml.cv_permutation_importance(
+            variables,
+            targets,
+            modelling_options["models"],
+            modelling_options["n_splits"],
+            modelling_options["n_repeats"],
+            n_jobs=n_jobs,
+            multioutput=modelling_options["multioutput"],
+            params=params,
+            fold_params=fold_params,
+        )
+        if cross_validation
+        else {
+            model_name: ml.permutation_importance(X_test, y_test, model, n_jobs=n_jobs)
+            for model_name, model in models.items()
+        }
+    )
+
+    predictions_list = []
+    shap_values = {}
+    for model_name, model in models.items():
+        predictions = (
+            cv_predictions[model_name]
+            if cross_validation
+            else ml.predict(X_test, y_test, model)
+        ).pipe(ml.evaluation)
+        predictions_list.append(predictions.assign(model=model_name))
+
+        if shap and "Regression" not in model_name:
+            shap_values[model_name] = ml.get_shap_values(
+                variables, model, modelling_options["feature_perturbation"]
+            )
+
+    predictions = pd.concat(predictions_list)
+    return {
+        "processing_options": processing_options,
+        "modelling_options": modelling_options,
+        "params": params,
+        "fold_params": fold_params if cross_validation else None,
+        "models": models,
+        "predictions": predictions,
+        "metrics": metrics.compute_metrics(predictions),
+        "importance": pd.concat(
+            [
+                values.assign(model=model_name)
+                for model_name, values in importance.items()
+            ],
+            ignore_index=True,
+        ),
+        "shap_values": shap_values,
+    }
+
+
+@timed
+@memoize(ignore=("n_jobs",))
+def compare_processing(
+    data: pd.DataFrame,
+    targets: list,
+    model_names: list,
+    n_splits: int = 5,
+    n_repeats: int = 1,
+    n_jobs: int = n_jobs,
+    multioutput: bool = True,
+    params: dict = None,
+    fold_params: list = None,
+) -> pd.DataFrame:
+    # cross-validated metrics of every processing variant, the (variant, model,
+    # fold) grid is fitted in a single parallel run; folds, hyperparameters and
+    # fits are those of ml.cross_validate, so that the selected variant scores as
+    # in the model evaluation
+    fold_params = fold_params or [params or {}] * (n_splits * n_repeats)
+    feature_set = processing.build_feature_set(processing.feature_data(data))
+    variants = processing.processing_variants()
+    Y = data[targets].to_numpy(dtype=float)
+    features = [feature_set.select(options) for options in variants]
+    X = [variables.to_numpy(dtype=float) for variables in features]
+    folds = ml.cv_folds(Y.shape[0], n_splits, n_repeats)
+    grid = [
+        (variant, model_name, i, train, test)
+        for variant in range(len(variants))
+        for model_name in model_names
+        for i, (train, test) in enumerate(folds)
+    ]
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(ml._evaluate_fold)(
+            X[variant],
+            Y,
+            train,
+            test,
+            model_name,
+            multioutput,
+            fold_params[i].get(model_name),
+            features[variant].columns.to_list(),
+            targets,
+            0,
+        )
+        for variant, model_name, i, train, test in grid
+    )
+
+    # rows are identified by the index, as in ml.cross_validate, so that the
+    # bootstrap resamples a row with all its repeated predictions
+    index = np.concatenate([test for _, test in folds])
+    row_index = np.tile(data.index[index], len(targets))
+    predictions = []
+    for start in range(0, len(grid), len(folds)):
+        variant, model_name, _, _, _ = grid[start]
+        predicted = np.concatenate(
+            [
+                fold_predictions
+                for fold_predictions, _ in results[start : start + len(folds)]
+            ]
+        )
+        predictions.append(
+            pd.DataFrame(
+                {
+                    **variants[variant],
+                    "model": model_name,
+                    "target": np.repeat(targets, index.size),
+                    "real": Y[index].ravel(order="F"),
+                    "predicted": predicted.ravel(order="F"),
+                },
+                index=row_index,
+            )
+        )
+    return metrics.compute_metrics(
+        pd.concat(predictions),
+        ["normalization", "aggregation", "imbalance", "model", "target"],
+    )
+
+
+def save(results: dict, output_path: str) -> None:
+    os.makedirs(output_path, exist_ok=True)
+    results["predictions"].rename_axis("row").to_csv(
+        os.path.join(output_path, "predictions.csv")
+    )
+    results["metrics"].to_csv(os.path.join(output_path, "metrics.csv"), index=False)
+    results["importance"].to_csv(
+        os.path.join(output_path, "importance.csv"), index=False
+    )
+    joblib.dump(results["models"], os.path.join(output_path, "models.joblib"))
+    for model_name, values in results["shap_values"].items():
+        pd.concat(values, names=["target", "row"]).to_csv(
+            os.path.join(output_path, f"shap {model_name}.csv")
+        )
+    with open(os.path.join(output_path, "options.json"), "w") as f:
+        json.dump(
+            {
+                "processing": results["processing_options"],
+                "modelling": results["modelling_options"],
+                "params": results["params"],
+                "fold_params": results["fold_params"],
+            },
+            f,
+            indent=2,
+        )
+
+
+def main(
+    processing_options: dict,
+    modelling_options: dict,
+    data_path: str,
+    output_path: str,
+    n_jobs: int = n_jobs,
+    shap: bool = False,
+    compare: bool = False,
+) -> dict:
+    records = profiling.start()
+    results = run(processing_options, modelling_options, data_path, n_jobs, shap)
+    save(results, output_path)
+    if compare:
+        modelling_options = results["modelling_options"]
+        results["processing_comparison"] = compare_processing(
+            data.load_raw_data(data_path, targets=modelling_options["targets"]),
+            modelling_options["targets"],
+            modelling_options["models"],
+            modelling_options["n_splits"],
+            modelling_options["n_repeats"],
+            n_jobs,
+            modelling_options["multioutput"],
+            results["params"],
+            results["fold_params"],
+        )
+        results["processing_comparison"].to_csv(
+            os.path.join(output_path, "processing_comparison.csv"), index=False
+        )
+    profiling.export(records, os.path.join(output_path, "performance.jsonl"))
+    return results
@@ -1,11 +1,11 @@
 import altair as alt
 import numpy as np
 import pandas as pd
-import shap
 import streamlit as st
 
-from aqua import tables
+from aqua import correlation, density, metrics, tables
 from aqua._constant import forces_order
+from aqua.profiling import timed
 
 empty_axis = alt.Axis(labels=False, ticks=False, domain=False, grid=False)
 xaxis = alt.Axis(labelFlush=False)
@@ -13,32 +13,36 @@ xaxis = alt.Axis(labelFlush=False)
 colors = {"primary": "#f63366", "grey": "#4C566A", "dark": "#2E3440"}
 width = 280
 height = 75
+# rows above which residuals are binned (or sampled) rather than drawn one by one
+max_points = 5000
 
 
-def plot_kde(
-    value: str = "value", variable: str = "variable", **chart_kwargs
-) -> alt.Chart:
+def plot_kde(value: str = "value", **chart_kwargs) -> alt.Chart:
+    # draws the grids precomputed by `density.density_table`
     dist = (
         alt.Chart(height=height, width=width, **chart_kwargs)
-        .transform_density(value, as_=[value, "density"], groupby=[variable])
         .mark_area(color=colors["grey"], opacity=0.6)
         .encode(
-            alt.X(value, axis=xaxis), alt.Y("density:Q", title=None, axis=empty_axis)
+            alt.X(f"{value}:Q", axis=xaxis),
+            alt.Y("density:Q", title=None, axis=empty_axis),
         )
     )
     point = (
         alt.Chart()
+        .transform_filter("datum.summary")
         .mark_circle(size=120, color=colors["dark"], y="height")
-        .encode(alt.X(f"mean({value})", title=None, scale=alt.Scale(zero=False)))
+        .encode(alt.X("mean:Q", title=None, scale=alt.Scale(zero=False)))
     )
     bar = (
         alt.Chart()
+        .transform_filter("datum.summary")
         .mark_rule(size=5, color=colors["dark"], y="height")
-        .encode(alt.X(f"q1({value})"), alt.X2(f"q3({value})"))
+        .encode(alt.X("q1:Q"), alt.X2("q3:Q"))
     )
     return dist + bar + point
 
 
+@timed
 def plot_anthropometry(variables: pd.DataFrame) -> None:
     anthropo = variables[["Height", "Weight"]].melt()
 
@@ -46,25 +50,30 @@ def plot_anthropometry(variables: pd.DataFrame) -> None:
 
     plots = (
         plot_kde()
-        .facet(data=anthropo, column=alt.Column("variable", title=None))
+        .facet(
+            data=density.density_table(anthropo),
+            column=alt.Column("variable", title=None),
+        )
         .resolve_scale(x="independent", y="independent")
     )
     st.altair_chart(plots, use_container_width=True)
     # TODO caption?
 
 
+@timed
 def plot_forces(variables: pd.DataFrame) -> None:
     forces = variables.drop(["Height", "Weight"], axis=1).melt()
     forces[["type", "variable"]] = forces["variable"].str.split(expand=True)
 
     tables.describe_table(forces, groupby=["variable", "type"], description="variables")
+    forces_density = density.density_table(forces, ["variable", "type"])
     row_kwargs = dict(shorthand="variable", title=None, sort=forces_order)
     column = alt.Column("type", title=None)
 
     forces_plot = (
         plot_kde()
         .facet(
-            data=forces.query("type != 'Imb'"),
+            data=forces_density.query("type != 'Imb'"),
             row=alt.Row(
                 header=alt.Header(labelAngle=0, labelAlign="left"), **row_kwargs
             ),
@@ -77,7 +86,7 @@ def plot_forces(variables: pd.DataFrame) -> None:
     imb_plot = (
         plot_kde()
         .facet(
-            data=forces.query("type == 'Imb'"),
+            data=forces_density.query("type == 'Imb'"),
             row=alt.Row(header=alt.Header(labelFontSize=0), **row_kwargs),
             column=column,
         )
@@ -89,6 +98,7 @@ def plot_forces(variables: pd.DataFrame) -> None:
     st.altair_chart(plots)
 
 
+@timed
 def plot_targets(targets: pd.DataFrame) -> None:
     targets_melted = targets.melt()
 
@@ -97,7 +107,7 @@ def plot_targets(targets: pd.DataFrame) -> None:
     dist_plot = (
         plot_kde()
         .facet(
-            data=targets_melted,
+            data=density.density_table(targets_melted),
             row=alt.Row(
                 "variable",
                 title=None,
@@ -111,9 +121,11 @@ def plot_targets(targets: pd.DataFrame) -> None:
     st.altair_chart(dist_plot)
 
 
+@timed
 def plot_error_dist(predictions: pd.DataFrame) -> None:
     predictions_melted = predictions.melt(id_vars="target", value_vars=["MAE", "MAPE"])
     tables.describe_table(predictions_melted, groupby=["target", "variable"])
+    errors_density = density.density_table(predictions_melted, ["target", "variable"])
 
     row_kwargs = dict(shorthand="target", title=None, sort=forces_order)
     column = alt.Column("variable", title=None)
@@ -121,7 +133,7 @@ def plot_error_dist(predictions: pd.DataFrame) -> None:
     mae = (
         plot_kde()
         .facet(
-            data=predictions_melted.query("variable == 'MAE'"),
+            data=errors_density.query("variable == 'MAE'"),
             row=alt.Row(
                 header=alt.Header(labelAngle=0, labelAlign="left"), **row_kwargs
             ),
@@ -134,7 +146,7 @@ def plot_error_dist(predictions: pd.DataFrame) -> None:
     mape = (
         plot_kde()
         .facet(
-            data=predictions_melted.query("variable == 'MAPE'"),
+            data=errors_density.query("variable == 'MAPE'"),
             row=alt.Row(header=alt.Header(labelFontSize=0), **row_kwargs),
             column=column,
         )
@@ -146,16 +158,13 @@ def plot_error_dist(predictions: pd.DataFrame) -> None:
     st.altair_chart(plots)
 
 
-def plot_correlation_matrix(variables: pd.DataFrame, targets: pd.DataFrame) -> None:
-    data = variables.join(targets).corr()
+@timed
+def plot_correlation_matrix(
+    variables: pd.DataFrame, targets: pd.DataFrame, method: str = "pearson"
+) -> None:
+    data = correlation.correlation_matrix([variables, targets], method)
     col_order = data.columns.to_list()
-
-    half_corr = (
-        data.where(np.triu(np.ones(data.shape)).astype(np.bool))
-        .reset_index()
-        .melt(id_vars="index")
-        .dropna()
-    )
+    half_corr = correlation.half_matrix(data)
 
     plot_dimension = 600
     corr = (
@@ -175,9 +184,54 @@ def plot_correlation_matrix(variables: pd.DataFrame, targets: pd.DataFrame) -> N
     st.altair_chart(corr)
 
 
-def plot_error_residuals(predictions: pd.DataFrame) -> None:
+@timed
+def plot_error_residuals(predictions: pd.DataFrame, mode: str = "Auto") -> None:
+    # only the plotted columns are sent to the browser
+    residuals = pd.DataFrame(
+        {
+            "target": predictions["target"].to_numpy(),
+            "predicted": predictions["predicted"].to_numpy(),
+            "Residuals": (predictions["predicted"] - predictions["real"]).to_numpy(),
+        }
+    )
+    if mode == "Auto":
+        mode = "Points" if residuals.shape[0] <= max_points else "Bins"
+
+    if mode == "Bins":
+        binned = density.histogram_table(
+            residuals, "predicted", "Residuals", ["target"]
+        )
+        heatmap = (
+            alt.Chart(width=width)
+            .mark_rect()
+            .encode(
+                alt.X(
+                    "predicted_start:Q", title="Predicted", scale=alt.Scale(zero=False)
+                ),
+                alt.X2("predicted_end:Q"),
+                alt.Y("Residuals_start:Q", title="Residuals"),
+                alt.Y2("Residuals_end:Q"),
+                alt.Color("count:Q", scale=alt.Scale(type="log", scheme="greys")),
+                alt.Tooltip("count:Q"),
+            )
+        )
+        rule = (
+            alt.Chart()
+            .transform_aggregate(n="count()")
+            .transform_calculate(zero="0")
+            .mark_rule(color=colors["primary"])
+            .encode(alt.Y("zero:Q"))
+        )
+        plots = (heatmap + rule).facet(
+            data=binned, column=alt.Column("target", title=None)
+        )
+        st.altair_chart(plots)
+        return
+
+    if mode == "Sample":
+        residuals = density.sample_table(residuals, ["target"], max_points)
     points = (
-        alt.Chart(predictions.eval("Residuals = predicted - real"))
+        alt.Chart(residuals)
         .mark_circle(size=100)
         .encode(
             alt.X("predicted", title="Predicted", scale=alt.Scale(zero=False)),
@@ -191,12 +245,91 @@ def plot_error_residuals(predictions: pd.DataFrame) -> None:
     st.altair_chart(points + rule, use_container_width=True)
 
 
+@timed
+def plot_metrics(scores: pd.DataFrame) -> None:
+    # score and bootstrap interval of every model, one row of panels per metric
+    base = alt.Chart(width=width, height=height).encode(alt.Y("model", title=None))
+    interval = base.mark_rule(size=3, color=colors["grey"]).encode(
+        alt.X("lower:Q", title=None, scale=alt.Scale(zero=False)), alt.X2("upper:Q")
+    )
+    point = base.mark_circle(size=80, color=colors["dark"], opacity=1).encode(
+        alt.X("value:Q"), alt.Tooltip(["value", "lower", "upper"])
+    )
+    plots = (
+        (interval + point)
+        .facet(
+            data=scores,
+            row=alt.Row(
+                "metric",
+                title=None,
+                sort=metrics.metric_names,
+                header=alt.Header(labelAngle=0, labelAlign="left"),
+            ),
+            column=alt.Column("target", title=None),
+        )
+        .resolve_scale(x="independent")
+        .configure_facet(spacing=5)
+    )
+    st.altair_chart(plots)
+
+
+@timed
+def plot_processing_comparison(report: pd.DataFrame, metric: str = "MAE") -> None:
+    groupby = ["normalization", "aggregation", "imbalance", "model", "target"]
+    tables.metrics_table(report, groupby)
+
+    scores = report[report["metric"] == metric].assign(
+        variant=lambda x: x["normalization"]
+        + " / "
+        + x["aggregation"]
+        + np.where(x["imbalance"], " / Imb", "")
+    )
+    variant_order = (
+        scores.groupby("variant")["value"].mean().sort_values().index.to_list()
+    )
+    base = alt.Chart(width=width).encode(
+        alt.Y("variant", title=None, sort=variant_order), alt.Color("model")
+    )
+    interval = base.mark_rule(size=2, opacity=0.6).encode(
+        alt.X("lower:Q", title=metric, scale=alt.Scale(zero=False)), alt.X2("upper:Q")
+    )
+    point = base.mark_circle(size=80, opacity=1).encode(
+        alt.X("value:Q"), alt.Tooltip(["model", "value", "lower", "upper"])
+    )
+    plots = (
+        (interval + point)
+        .facet(data=scores, column=alt.Column("target", title=None))
+        .resolve_scale(x="independent")
+    )
+    st.altair_chart(plots)
+
+
+@timed
 def model_comparison(predictions_list: list):
-    predictions_melted = pd.concat(predictions_list).melt(
-        id_vars="model", value_vars=["MAE", "MAPE"]
+    # aggregated scores with bootstrap intervals, computed (and cached) per model
+    scores = pd.concat(
+        [metrics.compute_metrics(predictions) for predictions in predictions_list],
+        ignore_index=True,
+    )
+    tables.metrics_table(scores)
+    plot_metrics(scores)
+
+    # long (model, variable, value) frame assembled from the error columns, without
+    # concatenating and melting the full prediction frames
+    errors = ["MAE", "MAPE"]
+    models = np.concatenate([p["model"].to_numpy() for p in predictions_list])
+    predictions_melted = pd.DataFrame(
+        {
+            "model": np.tile(models, len(errors)),
+            "variable": np.repeat(errors, models.size),
+            "value": np.concatenate(
+                [p[error].to_numpy() for error in errors for p in predictions_list]
+            ),
+        }
     )
 
     tables.describe_table(predictions_melted, groupby=["model", "variable"])
+    errors_density = density.density_table(predictions_melted, ["model", "variable"])
 
     row_kwargs = dict(shorthand="model", title=None, sort=forces_order)
     column = alt.Column("variable", title=None)
@@ -204,7 +337,7 @@ def model_comparison(predictions_list: list):
     mae = (
         plot_kde()
         .facet(
-            data=predictions_melted.query("variable == 'MAE'"),
+            data=errors_density.query("variable == 'MAE'"),
             row=alt.Row(
                 header=alt.Header(labelAngle=0, labelAlign="left"), **row_kwargs
             ),
@@ -217,7 +350,7 @@ def model_comparison(predictions_list: list):
     mape = (
         plot_kde()
         .facet(
-            data=predictions_melted.query("variable == 'MAPE'"),
+            data=errors_density.query("variable == 'MAPE'"),
             row=alt.Row(header=alt.Header(labelFontSize=0), **row_kwargs),
             column=column,
         )
@@ -229,58 +362,156 @@ def model_comparison(predictions_list: list):
     st.altair_chart(plots)
 
 
-def plot_shap_values(X: pd.DataFrame, model: dict) -> pd.DataFrame:
-    target = "EB mean force"
-    # st.pyplot(
-    #     shap.summary_plot(shap.TreeExplainer(model[target], data=X).shap_values(X), X)
-    # )
-
-    shap_values = pd.DataFrame(
-        shap.TreeExplainer(model[target], data=X).shap_values(X), columns=X.columns
-    )
-
-    y_order = shap_values.abs().mean().nlargest(6).index.to_list()
-    shap_values = shap_values[y_order].melt()
-    # shap_values["rank"] = X.rank().melt()["value"].values
-    shap_values["Z-score"] = ((X[y_order] - X[y_order].mean()) / X[y_order].std()).melt()["value"].clip(-0.5, 0.5)
-
-    # dist = (
-    #     alt.Chart(shap_values)
-    #     .mark_circle(size=100)
-    #     .encode(
-    #         alt.X("value", title=None),
-    #         alt.Y("variable", title=None, sort=y_order),
-    #         alt.Color("Z-score", scale=alt.Scale(scheme="redblue", domain=[-2.5, 2.5])),
-    #     )
-    # )
-    # rule = alt.Chart(pd.DataFrame([{'zero': 0}])).mark_rule().encode(alt.X('zero'))
-
-
-    stripplot = alt.Chart(shap_values, height=20, width=width).mark_circle(size=100, clip=True).encode(
-        alt.Y(
-            'jitter:Q',
-            title=None,
-            axis=alt.Axis(values=[0], ticks=False, grid=False, labels=False),
-        ),
-        alt.X('value', title="Shap value", scale=alt.Scale(domain=[-.4, .4])),
-        alt.Color("Z-score", scale=alt.Scale(scheme="redblue", domain=[-0.5, 0.5])),
-        alt.Row(
-            'variable',
-            title=None,
-            sort=y_order,
-            header=alt.Header(
-                labelAngle=0,
-                labelAlign='left',
-            ),
-        ),
-    ).transform_calculate(
-        jitter='sqrt(-2*log(random()))*cos(2*PI*random())'
-    ).configure_facet(
-        spacing=0
-    ).configure_view(
-        stroke=None
+@timed
+def plot_shap_values(X: pd.DataFrame, shap_values: dict) -> None:
+    z_scores = ((X - X.mean()) / X.std()).clip(-0.5, 0.5)
+
+    for target, values in shap_values.items():
+        y_order = values.abs().mean().nlargest(6).index.to_list()
+        target_values = values[y_order].melt()
+        target_values["Z-score"] = z_scores[y_order].melt()["value"].to_numpy()
+        limit = target_values["value"].abs().max()
+
+        stripplot = (
+            alt.Chart(target_values, height=20, width=width, title=target)
+            .mark_circle(size=100, clip=True)
+            .encode(
+                alt.Y(
+                    "jitter:Q",
+                    title=None,
+                    axis=alt.Axis(values=[0], ticks=False, grid=False, labels=False),
+                ),
+                alt.X(
+                    "value", title="Shap value", scale=alt.Scale(domain=[-limit, limit])
+                ),
+                alt.Color(
+                    "Z-score", scale=alt.Scale(scheme="redblue", domain=[-0.5, 0.5])
+                ),
+                alt.Row(
+                    "variable",
+                    title=None,
+                    sort=y_order,
+                    header=alt.Header(labelAngle=0, labelAlign="left"),
+                ),
+            )
+            .transform_calculate(jitter="sqrt(-2*log(random()))*cos(2*PI*random())")
+            .configure_facet(spacing=0)
+            .configure_view(stroke=None)
+        )
+
+        st.altair_chart(stripplot)
+
+
+@timed
+def plot_coefficients(coefficients: pd.DataFrame) -> None:
+    # posterior mean and 90% interval of the standardized coefficients
+    feature_order = (
+        coefficients.groupby("feature")["mean"]
+        .apply(lambda x: x.abs().mean())
+        .sort_values(ascending=False)
+        .index.to_list()
+    )
+    base = alt.Chart(width=width).encode(
+        alt.Y("feature", title=None, sort=feature_order)
+    )
+    interval = base.mark_rule(size=3, color=colors["grey"]).encode(
+        alt.X("lower:Q", title="Coefficient"), alt.X2("upper:Q")
+    )
+    point = base.mark_circle(size=80, color=colors["dark"], opacity=1).encode(
+        alt.X("mean:Q"), alt.Tooltip(["mean", "sd", "lower", "upper"])
+    )
+    zero = (
+        alt.Chart()
+        .transform_aggregate(n="count()")
+        .transform_calculate(zero="0")
+        .mark_rule(color=colors["primary"])
+        .encode(alt.X("zero:Q"))
+    )
+    plots = (
+        (zero + interval + point)
+        .facet(data=coefficients, column=alt.Column("target", title=None))
+        .resolve_scale(x="independent")
     )
+    st.altair_chart(plots)
 
 
+@timed
+def plot_predictive_density(densities: pd.DataFrame, targets: pd.DataFrame) -> None:
+    # posterior predictive samples against the observed distribution of each target
+    observed = density.density_table(targets.melt()).rename(
+        columns={"variable": "target"}
+    )
+    samples = (
+        alt.Chart()
+        .mark_line(color=colors["grey"], opacity=0.2, strokeWidth=1)
+        .encode(alt.X("value:Q", title=None), alt.Y("density:Q"), alt.Detail("sample"))
+    )
+    actual = (
+        alt.Chart()
+        .mark_line(color=colors["primary"], strokeWidth=3)
+        .encode(alt.X("value:Q"), alt.Y("density:Q"))
+        .transform_filter("datum.sample == null")
+    )
+    data = pd.concat([densities, observed[["target", "value", "density"]]])
+    plots = (
+        (samples.transform_filter("datum.sample != null") + actual)
+        .facet(data=data, column=alt.Column("target", title=None))
+        .resolve_scale(x="independent", y="independent")
+    )
+    st.altair_chart(plots)
+
 
-    st.altair_chart(stripplot)
+@timed
+def plot_permutation_importance(importance: pd.DataFrame, n_variables: int = 8) -> None:
+    # variables with the largest mean importance across targets
+    variable_order = (
+        importance.groupby("variable")["importance"]
+        .mean()
+        .nlargest(n_variables)
+        .index.to_list()
+    )
+    base = alt.Chart(width=width).encode(
+        alt.Y("variable", title=None, sort=variable_order)
+    )
+    bar = base.mark_bar(color=colors["grey"]).encode(
+        alt.X("importance:Q", title="MAE increase"),
+        alt.Tooltip(["importance", "std"]),
+    )
+    error = (
+        base.transform_calculate(
+            lower="datum.importance - datum.std", upper="datum.importance + datum.std"
+        )
+        .mark_rule(color=colors["dark"])
+        .encode(alt.X("lower:Q"), alt.X2("upper:Q"))
+    )
+    plots = (
+        (bar + error)
+        .facet(
+            data=importance[importance["variable"].isin(variable_order)],
+            column=alt.Column("target", title=None),
+        )
+        .resolve_scale(x="independent")
+    )
+    st.altair_chart(plots)
+
+
+@timed
+def plot_coefficient_path(path: pd.DataFrame) -> None:
+    lines = (
+        alt.Chart(width=width)
+        .mark_line()
+        .encode(
+            alt.X(
+                "alpha:Q",
+                title="Penalty",
+                scale=alt.Scale(type="log", reverse=True),
+            ),
+            alt.Y("coefficient:Q", title="Coefficient"),
+            alt.Color("variable", title=None),
+            alt.Tooltip(["variable", "alpha", "coefficient"]),
+        )
+    )
+    plots = lines.facet(
+        data=path, column=alt.Column("target", title=None)
+    ).resolve_scale(x="independent", y="independent")
+    st.altair_chart(plots)
@@ -1,28 +1,159 @@
+import itertools
+from functools import lru_cache
+from typing import NamedTuple
+
+import numpy as np
 import pandas as pd
 
+from aqua._constant import (
+    aggregation_strategies,
+    available_targets,
+    normalization_strategies,
+)
+from aqua.cache import memoize
+from aqua.profiling import timed
 
-def process_force_data(data: pd.DataFrame, options: dict) -> pd.DataFrame:
-    forces = data.filter(like="/").pipe(
-        normalize_force_data, data, options["normalization"]
+
+class ColumnPlan(NamedTuple):
+    others: np.ndarray
+    left: np.ndarray
+    right: np.ndarray
+    forces: list
+
+
+@lru_cache(maxsize=16)
+def compile_column_plan(columns: tuple) -> ColumnPlan:
+    # forces are labelled "<force>/L" and "<force>/R", sides are paired by name
+    # rather than position
+    left = {c[:-2]: i for i, c in enumerate(columns) if c.endswith("/L")}
+    right = {c[:-2]: i for i, c in enumerate(columns) if c.endswith("/R")}
+    if left.keys() != right.keys():
+        raise ValueError(f"unpaired force columns: {set(left) ^ set(right)}")
+    forces = list(left)
+    return ColumnPlan(
+        others=np.array([i for i, c in enumerate(columns) if "/" not in c], dtype=int),
+        left=np.array([left[force] for force in forces], dtype=int),
+        right=np.array([right[force] for force in forces], dtype=int),
+        forces=forces,
     )
 
-    left = forces.filter(like="/L").rename(columns=lambda x: x[:-2])
-    right = forces.filter(like="/R").rename(columns=lambda x: x[:-2])
 
-    processed = aggregate_force_data(left, right, options["aggregation"])
+class FeatureSet(NamedTuple):
+    # processing variants of the same forces and anthropometry: `aggregated` holds
+    # one (force, row) matrix per (normalization, aggregation) pair of `variants`,
+    # the imbalance does not depend on the normalization and is stored once
+    others: pd.DataFrame
+    forces: list
+    variants: list
+    aggregated: np.ndarray
+    imbalance: np.ndarray
+
+    def select(self, options: dict, others: pd.DataFrame = None) -> pd.DataFrame:
+        # `others` replaces the unprocessed columns, e.g. to add the targets back
+        others = self.others if others is None else others
+        variant = self.variants.index(
+            (options["normalization"], options["aggregation"])
+        )
+        n_forces = len(self.forces)
+        columns = [f"{options['aggregation']} {force}" for force in self.forces]
+        if options["imbalance"]:
+            columns += [f"Imb {force}" for force in self.forces]
+        processed = np.empty((len(columns), others.shape[0]))
+        processed[:n_forces] = self.aggregated[variant]
+        if options["imbalance"]:
+            processed[n_forces:] = self.imbalance
+
+        # the transposed (row, column) view is column-major, which pandas takes as is
+        processed = pd.DataFrame(processed.T, index=others.index, columns=columns)
+        return pd.concat([others, processed], axis=1)
+
+
+def processing_variants() -> list:
+    return [
+        {
+            "normalization": normalization,
+            "aggregation": aggregation,
+            "imbalance": imbalance,
+        }
+        for normalization, aggregation, imbalance in itertools.product(
+            normalization_strategies, aggregation_strategies, [True, False]
+        )
+    ]
+
+
+def feature_data(data: pd.DataFrame) -> pd.DataFrame:
+    # the columns the processing depends on, a feature set is shared by all the
+    # target selections
+    return data.drop(columns=available_targets, errors="ignore")
+
+
+@timed
+@memoize
+def build_feature_set(data: pd.DataFrame) -> FeatureSet:
+    return _build_feature_set(
+        data, list(itertools.product(normalization_strategies, aggregation_strategies))
+    )
+
+
+def _build_feature_set(data: pd.DataFrame, variants: list) -> FeatureSet:
+    plan = compile_column_plan(tuple(data.columns))
+    n_forces, n_rows = len(plan.forces), data.shape[0]
+    normalizations = list(dict.fromkeys(normalization for normalization, _ in variants))
+    aggregations = list(dict.fromkeys(aggregation for _, aggregation in variants))
+
+    # left and right forces are gathered once into a contiguous (side, force, row)
+    # matrix
+    forces = np.empty((2, n_forces, n_rows))
+    for side, indices in enumerate((plan.left, plan.right)):
+        for i, column in enumerate(indices):
+            forces[side, i] = data.iloc[:, column].to_numpy(dtype=float)
+    left, right = forces
+
+    # both aggregations are homogeneous, aggregating normalized forces is the same as
+    # normalizing the aggregated ones: every aggregation is computed once and divided
+    # by all the normalizers in a single broadcast
+    aggregated = np.stack(
+        [aggregate_force_data(left, right, strategy) for strategy in aggregations]
+    )
+    normalizers = np.stack(
+        [
+            np.ones(n_rows) if normalizer is None else normalizer
+            for normalizer in (
+                force_normalizer(data, strategy) for strategy in normalizations
+            )
+        ]
+    )
+    aggregated = aggregated / normalizers[:, np.newaxis, np.newaxis]
+
+    return FeatureSet(
+        others=data.iloc[:, plan.others],
+        forces=plan.forces,
+        variants=list(itertools.product(normalizations, aggregations)),
+        aggregated=aggregated.reshape(-1, n_forces, n_rows),
+        imbalance=compute_force_imbalance(left, right),
+    )
+
+
+@timed
+@memoize
+def process_force_data(data: pd.DataFrame, options: dict) -> pd.DataFrame:
+    # a view of the feature set, switching options or targets does not reprocess
+    # the forces
+    others = data.iloc[:, compile_column_plan(tuple(data.columns)).others]
+    return build_feature_set(feature_data(data)).select(options, others)
 
-    if options["imbalance"]:
-        imbalance = compute_force_imbalance(left, right)
-        processed[imbalance.columns] = imbalance
 
-    return data.drop(forces.columns, axis=1).join(processed)
+def process_rows(data: pd.DataFrame, options: dict) -> pd.DataFrame:
+    # uncached processing of the selected variant only, for rows seldom seen twice
+    # (e.g. prediction requests)
+    others = data.iloc[:, compile_column_plan(tuple(data.columns)).others]
+    variant = [(options["normalization"], options["aggregation"])]
+    return _build_feature_set(feature_data(data), variant).select(options, others)
 
 
-def normalize_force_data(
-    forces: pd.DataFrame, data: pd.DataFrame, strategy: str
-) -> pd.DataFrame:
+def force_normalizer(data: pd.DataFrame, strategy: str) -> np.ndarray:
     if strategy == "None":
-        return forces
+        return None
     elif strategy == "Weight":
         normalizer = data["Weight"]
     elif strategy == "Weight x Height":
@@ -31,19 +162,31 @@ def normalize_force_data(
         normalizer = data["Weight"] / data["Height"] ** 2
     else:
         raise ValueError(f"{strategy} is not a force normalization strategy")
-    return forces.divide(normalizer, axis=0)
+    return normalizer.to_numpy(dtype=float)
 
 
 def aggregate_force_data(
-    left: pd.DataFrame, right: pd.DataFrame, strategy: str
-) -> pd.DataFrame:
+    left: np.ndarray, right: np.ndarray, strategy: str, out: np.ndarray = None
+) -> np.ndarray:
+    if out is None:
+        out = np.empty_like(left)
     if strategy == "F-score":
-        return (2 * (left * right) / (left + right)).add_prefix("F-score ")
+        np.multiply(left, right, out=out)
+        out *= 2
+        out /= left + right
     elif strategy == "Mean":
-        return ((left + right) / 2).add_prefix("Mean ")
+        np.add(left, right, out=out)
+        out /= 2
     else:
         raise ValueError(f"{strategy} is not an aggregation strategy")
+    return out
 
 
-def compute_force_imbalance(left: pd.DataFrame, right: pd.DataFrame) -> pd.DataFrame:
-    return (((left - right) / left).abs() * 100).add_prefix("Imb ")
+def compute_force_imbalance(
+    left: np.ndarray, right: np.ndarray, out: np.ndarray = None
+) -> np.ndarray:
+    out = np.subtract(left, right, out=out)
+    out /= left
+    np.abs(out, out=out)
+    out *= 100
+    return out
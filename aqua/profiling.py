@@ -0,0 +1,69 @@
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# records of the current script run, a streamlit run executes in its own thread and
+# thus its own context
+_records = contextvars.ContextVar("records", default=None)
+_depth = contextvars.ContextVar("depth", default=0)
+
+
+def _memory() -> int:
+    # resident set size in bytes, 0 where /proc is not available
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+def start() -> list:
+    records = []
+    _records.set(records)
+    return records
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    depth = _depth.get()
+    token = _depth.set(depth + 1)
+    memory = _memory()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        record = {
+            "stage": name,
+            "depth": depth,
+            "start": wall_start,
+            "wall_time": time.perf_counter() - wall_start,
+            "cpu_time": time.process_time() - cpu_start,
+            "memory_delta": _memory() - memory,
+        }
+        _depth.reset(token)
+        records = _records.get()
+        if records is not None:
+            records.append(record)
+        logger.debug(json.dumps(record))
+
+
+def timed(func):
+    name = f"{func.__module__}.{func.__qualname__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with stage(name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def export(records: list, path: str) -> None:
+    with open(path, "a") as f:
+        f.writelines(json.dumps(record) + "\n" for record in records)
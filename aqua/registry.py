@@ -0,0 +1,139 @@
+import contextlib
+import glob
+import json
+import os
+import time
+
+import joblib
+import pandas as pd
+
+from aqua import ml
+from aqua._constant import n_jobs
+from aqua.cache import file_digest, fingerprint, memoize
+from aqua.profiling import timed
+
+registry_path = os.environ.get("AQUA_REGISTRY_PATH", "./.aqua_cache/models")
+
+
+def entry_paths(key: str, path: str = registry_path) -> tuple:
+    return os.path.join(path, f"{key}.joblib"), os.path.join(path, f"{key}.json")
+
+
+def save_model(model: dict, meta: dict, path: str = registry_path) -> None:
+    # the metadata is written last, an entry without it is incomplete and ignored
+    model_path, meta_path = entry_paths(meta["key"], path)
+    os.makedirs(path, exist_ok=True)
+    tmp_path = f"{model_path}.{os.getpid()}.tmp"
+    joblib.dump(model, tmp_path)
+    os.replace(tmp_path, model_path)
+
+    tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, meta_path)
+
+
+def load_model(key: str, path: str = registry_path, mmap_mode: str = "r") -> dict:
+    # arrays (coefficients, tree nodes) are memory-mapped rather than read in memory,
+    # estimators copying them into their own buffers on unpickling still load them
+    model_path, _ = entry_paths(key, path)
+    return joblib.load(model_path, mmap_mode=mmap_mode)
+
+
+def entries(path: str = registry_path) -> list:
+    metas = []
+    for meta_path in glob.glob(os.path.join(path, "*.json")):
+        with contextlib.suppress(OSError, ValueError):
+            with open(meta_path) as f:
+                metas.append(json.load(f))
+    return sorted(metas, key=lambda meta: meta["created"])
+
+
+def find(path: str = registry_path, **filters) -> list:
+    # entries whose metadata matches all `filters`, oldest first
+    return [
+        meta
+        for meta in entries(path)
+        if all(meta.get(field) == value for field, value in filters.items())
+    ]
+
+
+def prune(data_path: str, data_digest: str, path: str = registry_path) -> list:
+    # models trained on another version of the same raw data file are removed, the
+    # registry is shared with models trained on other files
+    data_path = os.path.abspath(data_path)
+    stale = [
+        meta
+        for meta in entries(path)
+        if meta.get("data_path") == data_path and meta["data_digest"] != data_digest
+    ]
+    for meta in stale:
+        for stale_path in entry_paths(meta["key"], path):
+            with contextlib.suppress(OSError):
+                os.remove(stale_path)
+    return stale
+
+
+@timed
+@memoize(files=("data_path",), ignore=("n_jobs",))
+def train_models(
+    X_train: pd.DataFrame,
+    y_train: pd.DataFrame,
+    model_names: list,
+    processing_options: dict,
+    data_path: str,
+    n_jobs: int = n_jobs,
+    multioutput: bool = True,
+    params: dict = None,
+    path: str = registry_path,
+) -> dict:
+    # same as ml.train_models, but models already fitted on the same rows with the
+    # same options are loaded from the registry instead of being refitted
+    params = params or {}
+    data_digest = file_digest(data_path)
+    prune(data_path, data_digest, path)
+
+    data_key = fingerprint(X_train, y_train)
+    keys = {
+        model_name: fingerprint(
+            data_key, model_name, multioutput, params.get(model_name)
+        )
+        for model_name in model_names
+    }
+    registered = {meta["key"] for meta in entries(path)}
+    missing = [
+        model_name for model_name in model_names if keys[model_name] not in registered
+    ]
+
+    fitted = (
+        ml.train_models(X_train, y_train, missing, n_jobs, multioutput, params)
+        if missing
+        else {}
+    )
+    for model_name, model in fitted.items():
+        save_model(
+            model,
+            {
+                "key": keys[model_name],
+                "model": model_name,
+                "targets": y_train.columns.to_list(),
+                "features": X_train.columns.to_list(),
+                "processing_options": processing_options,
+                "multioutput": multioutput,
+                "params": params.get(model_name),
+                "data_path": os.path.abspath(data_path),
+                "data_digest": data_digest,
+                "n_rows": X_train.shape[0],
+                "created": time.time(),
+            },
+            path,
+        )
+
+    return {
+        model_name: (
+            fitted[model_name]
+            if model_name in fitted
+            else load_model(keys[model_name], path)
+        )
+        for model_name in model_names
+    }
@@ -0,0 +1,236 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from aqua import ml, processing, registry
+
+
+class Predictor:
+    # a registered model with the processing options it was trained with, predicting
+    # all its targets from raw test rows (same columns as data/raw.csv, targets
+    # excluded)
+    def __init__(self, model: dict, meta: dict):
+        self.model = model
+        self.meta = meta
+        self.columns = required_columns(meta)
+
+    @classmethod
+    def from_registry(
+        cls, model_name: str, path: str = registry.registry_path, **filters
+    ) -> "Predictor":
+        # latest entry of `model_name` matching `filters` (e.g. processing_options)
+        metas = registry.find(path, model=model_name, **filters)
+        if not metas:
+            raise LookupError(f"no registered {model_name} model matching {filters}")
+        meta = metas[-1]
+        return cls(registry.load_model(meta["key"], path), meta)
+
+    def validate(self, rows: pd.DataFrame) -> pd.DataFrame:
+        # the raw columns the model needs, all present, numeric and non-null; every
+        # validated request has the same columns and can be batched with the others
+        missing = [column for column in self.columns if column not in rows]
+        if missing:
+            raise ValueError(f"missing columns {missing}")
+        rows = rows[self.columns]
+        nulls = rows.columns[rows.isna().any().to_numpy()].to_list()
+        if nulls:
+            raise ValueError(f"null values in columns {nulls}")
+        non_numeric = [
+            column
+            for column, dtype in rows.dtypes.items()
+            if not pd.api.types.is_numeric_dtype(dtype)
+            or pd.api.types.is_bool_dtype(dtype)
+        ]
+        if non_numeric:
+            raise ValueError(f"non-numeric values in columns {non_numeric}")
+        return rows
+
+    def predict(self, rows: pd.DataFrame) -> pd.DataFrame:
+        X = processing.process_rows(
+            self.validate(rows), self.meta["processing_options"]
+        )
+        return ml.predict_targets(X[self.meta["features"]], self.model)
+
+
+def required_columns(meta: dict) -> list:
+    # raw columns behind the features of a registered model: the force pairs of the
+    # aggregated and imbalance features, the normalizers and the other features
+    aggregation = meta["processing_options"]["aggregation"]
+    columns = []
+    for feature in meta["features"]:
+        prefix, _, force = feature.partition(" ")
+        if prefix in (aggregation, "Imb") and force:
+            columns += [f"{force}/L", f"{force}/R"]
+        else:
+            columns.append(feature)
+    columns += {
+        "None": [],
+        "Weight": ["Weight"],
+    }.get(meta["processing_options"]["normalization"], ["Weight", "Height"])
+    return list(dict.fromkeys(columns))
+
+
+class MicroBatcher:
+    # requests submitted within `max_delay` seconds of each other are predicted in
+    # one call, up to `max_batch` rows
+    def __init__(self, predict, max_batch: int = 1024, max_delay: float = 0.002):
+        self.predict = predict
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, rows: pd.DataFrame) -> Future:
+        future = Future()
+        self.queue.put((rows, future))
+        return future
+
+    def __call__(self, rows: pd.DataFrame) -> pd.DataFrame:
+        return self.submit(rows).result()
+
+    def _collect(self) -> list:
+        batch = [self.queue.get()]
+        n_rows = batch[0][0].shape[0]
+        deadline = time.monotonic() + self.max_delay
+        while n_rows < self.max_batch:
+            try:
+                batch.append(
+                    self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                )
+            except queue.Empty:
+                break
+            n_rows += batch[-1][0].shape[0]
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            # only requests with the same columns are concatenated
+            groups = {}
+            for rows, future in self._collect():
+                groups.setdefault(tuple(rows.columns), []).append((rows, future))
+            for batch in groups.values():
+                self._predict_batch(batch)
+
+    def _predict_batch(self, batch: list) -> None:
+        try:
+            predictions = self.predict(
+                pd.concat([rows for rows, _ in batch], ignore_index=True)
+            )
+        except Exception as error:
+            if len(batch) == 1:
+                batch[0][1].set_exception(error)
+                return
+            # an invalid request does not fail the others of its batch
+            for rows, future in batch:
+                try:
+                    future.set_result(self.predict(rows))
+                except Exception as error:
+                    future.set_exception(error)
+            return
+
+        offsets = np.cumsum([0] + [rows.shape[0] for rows, _ in batch])
+        for (rows, future), start, stop in zip(batch, offsets[:-1], offsets[1:]):
+            future.set_result(predictions.iloc[start:stop].set_axis(rows.index))
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    # GET /models lists the served models, POST /predict takes
+    # {"model": name, "rows": [{column: value}, ...]} and returns
+    # {"model": name, "predictions": [{target: value}, ...]}
+    def do_GET(self):
+        if self.path != "/models":
+            return self._send(404, {"error": f"unknown path {self.path}"})
+        self._send(200, {name: p.meta for name, p in self.server.predictors.items()})
+
+    def do_POST(self):
+        if self.path != "/predict":
+            return self._send(404, {"error": f"unknown path {self.path}"})
+        try:
+            length = self.headers.get("Content-Length")
+            if length is None:
+                return self._send(411, {"error": "missing Content-Length"})
+            request = json.loads(self.rfile.read(int(length)))
+            if not isinstance(request, dict):
+                raise ValueError("request body must be a JSON object")
+            model_name = request.get("model", next(iter(self.server.predictors)))
+            batcher = self.server.batchers[model_name]
+            # invalid rows are rejected before they can be batched with other requests
+            rows = self.server.predictors[model_name].validate(
+                pd.DataFrame(request["rows"])
+            )
+            predictions = batcher(rows)
+        except KeyError as error:
+            return self._send(400, {"error": f"unknown {error}"})
+        except (ValueError, TypeError) as error:
+            return self._send(400, {"error": str(error)})
+        except Exception as error:
+            # any other failure of the estimators is reported rather than dropping
+            # the connection
+            return self._send(500, {"error": f"{type(error).__name__}: {error}"})
+        self._send(
+            200, {"model": model_name, "predictions": predictions.to_dict("records")}
+        )
+
+    def _send(self, status: int, body: dict) -> None:
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(
+    predictors: dict,
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    max_batch: int = 1024,
+    max_delay: float = 0.002,
+) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), PredictionHandler)
+    server.predictors = predictors
+    server.batchers = {
+        name: MicroBatcher(predictor.predict, max_batch, max_delay)
+        for name, predictor in predictors.items()
+    }
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m aqua.serve", description="Serve registered models over HTTP"
+    )
+    parser.add_argument("--models", nargs="+", help="default: all registered models")
+    parser.add_argument("--registry", default=registry.registry_path)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch", type=int, default=1024)
+    parser.add_argument("--max-delay", type=float, default=0.002, help="seconds")
+    args = parser.parse_args()
+
+    model_names = args.models or list(
+        dict.fromkeys(meta["model"] for meta in registry.entries(args.registry))
+    )
+    predictors = {
+        model_name: Predictor.from_registry(model_name, args.registry)
+        for model_name in model_names
+    }
+    server = make_server(
+        predictors, args.host, args.port, args.max_batch, args.max_delay
+    )
+    print(f"serving {', '.join(predictors)} on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
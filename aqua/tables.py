@@ -4,22 +4,37 @@ import streamlit as st
 from aqua._constant import variables_description, targets_description
 
 
-def mean_and_std_column(x):
-    mu = x.mean().round(2).astype(str)
-    sigma = x.std().round(2).astype(str)
+def mean_and_std_column(stats: pd.DataFrame) -> pd.Series:
+    mu = stats["mean"].round(2).astype(str)
+    sigma = stats["std"].round(2).astype(str)
     return mu + " (+/- " + sigma + ")"
 
 
+def interval_column(stats: pd.DataFrame) -> pd.Series:
+    value = stats["value"].round(2).astype(str)
+    lower = stats["lower"].round(2).astype(str)
+    upper = stats["upper"].round(2).astype(str)
+    return value + " [" + lower + ", " + upper + "]"
+
+
+def describe_groups(
+    data: pd.DataFrame, groupby: list, value: str = "value"
+) -> pd.DataFrame:
+    # all groups are reduced in a single aggregation, strings are only built once
+    # for the aggregated table
+    describe = mean_and_std_column(data.groupby(groupby)[value].agg(["mean", "std"]))
+
+    if describe.index.nlevels > 1:
+        return describe.unstack()
+    return describe.to_frame(value)
+
+
 def describe_table(
     data: pd.DataFrame, groupby: list = None, description: str = None
 ) -> None:
     if groupby is None:
         groupby = ["variable"]
-    describe = data.groupby(groupby).apply(mean_and_std_column)
-
-    if describe.index.nlevels > 1:
-        describe = describe.unstack()
-        describe.columns = describe.columns.get_level_values(1)
+    describe = describe_groups(data, groupby)
 
     if description:
         describe.insert(
@@ -32,3 +47,13 @@ def describe_table(
             ),
         )
     st.dataframe(describe)
+
+
+def metrics_table(scores: pd.DataFrame, groupby: list = None) -> None:
+    # one row per group (by default (model, target)), one column per metric
+    if groupby is None:
+        groupby = ["model", "target"]
+    table = scores.assign(score=interval_column(scores)).pivot(
+        index=groupby, columns="metric", values="score"
+    )
+    st.dataframe(table[scores["metric"].unique()])
@@ -0,0 +1,163 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+
+from aqua import ml
+from aqua._constant import n_jobs, random_seed, search_spaces
+from aqua.cache import fingerprint, memoize
+from aqua.profiling import timed
+
+trials_path = os.environ.get("AQUA_TRIALS_PATH", "./.aqua_cache/trials.jsonl")
+
+
+def sample_candidates(model_name: str, n_candidates: int) -> list:
+    # sklearn is only imported once the modelling starts to speed up the first page
+    from sklearn import model_selection
+
+    space = search_spaces[model_name]
+    n_candidates = min(n_candidates, len(model_selection.ParameterGrid(space)))
+    return list(
+        model_selection.ParameterSampler(space, n_candidates, random_state=random_seed)
+    )
+
+
+def load_trials(path: str = trials_path) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return {trial["key"]: trial["score"] for trial in map(json.loads, f)}
+
+
+def save_trials(trials: list, path: str = trials_path) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as f:
+        f.writelines(json.dumps(trial) + "\n" for trial in trials)
+
+
+def _score_candidate(
+    X: np.ndarray,
+    Y: np.ndarray,
+    model_name: str,
+    params: dict,
+    n_splits: int,
+    multioutput: bool,
+) -> float:
+    # MAE averaged over folds and targets, each target scaled by its spread
+    from sklearn import model_selection
+
+    scale = Y.std(axis=0)
+    errors = [
+        np.mean(
+            np.abs(
+                ml._fit_predict_fold(X, Y, train, test, model_name, multioutput, params)
+                - Y[test]
+            )
+            / scale
+        )
+        for train, test in model_selection.KFold(n_splits).split(X)
+    ]
+    return float(np.mean(errors))
+
+
+@memoize(ignore=("n_jobs",))
+def successive_halving(
+    X: pd.DataFrame,
+    y: pd.DataFrame,
+    model_name: str,
+    n_candidates: int = 27,
+    factor: int = 3,
+    n_splits: int = 3,
+    n_jobs: int = n_jobs,
+    multioutput: bool = True,
+    path: str = trials_path,
+) -> dict:
+    # every rung evaluates the remaining candidates on `factor` times more rows
+    # than the previous one and only keeps the best 1 / `factor` of them
+    candidates = sample_candidates(model_name, n_candidates)
+    n_rungs = max(int(np.ceil(np.log(len(candidates)) / np.log(factor))), 1)
+
+    rows = np.random.RandomState(random_seed).permutation(X.shape[0])
+    X_array = X.to_numpy(dtype=float)[rows]
+    Y_array = y.to_numpy(dtype=float)[rows]
+    min_resources = min(4 * n_splits, X.shape[0])
+
+    data_key = fingerprint(X, y)
+    trials = load_trials(path)
+    for rung in range(n_rungs):
+        resources = max(X.shape[0] // factor ** (n_rungs - 1 - rung), min_resources)
+        keys = [
+            fingerprint(data_key, model_name, params, resources, n_splits, multioutput)
+            for params in candidates
+        ]
+        pending = [
+            (key, params) for key, params in zip(keys, candidates) if key not in trials
+        ]
+        scores = Parallel(n_jobs=n_jobs)(
+            delayed(_score_candidate)(
+                X_array[:resources],
+                Y_array[:resources],
+                model_name,
+                params,
+                n_splits,
+                multioutput,
+            )
+            for _, params in pending
+        )
+
+        completed = [
+            {
+                "key": key,
+                "model": model_name,
+                "params": params,
+                "resources": resources,
+                "score": score,
+            }
+            for (key, params), score in zip(pending, scores)
+        ]
+        save_trials(completed, path)
+        trials.update({trial["key"]: trial["score"] for trial in completed})
+
+        ranking = np.argsort([trials[key] for key in keys], kind="stable")
+        candidates = [
+            candidates[i] for i in ranking[: max(len(candidates) // factor, 1)]
+        ]
+    return candidates[0]
+
+
+@timed
+def tune_models(
+    X: pd.DataFrame,
+    y: pd.DataFrame,
+    model_names: list,
+    n_jobs: int = n_jobs,
+    multioutput: bool = True,
+) -> dict:
+    return {
+        model_name: successive_halving(
+            X, y, model_name, n_jobs=n_jobs, multioutput=multioutput
+        )
+        for model_name in model_names
+    }
+
+
+@timed
+def tune_folds(
+    variables: pd.DataFrame,
+    targets: pd.DataFrame,
+    model_names: list,
+    n_splits: int = 5,
+    n_repeats: int = 1,
+    n_jobs: int = n_jobs,
+    multioutput: bool = True,
+) -> list:
+    # nested search: hyperparameters of each cross-validation fold are tuned on its
+    # training rows only, so that the fold's test rows score them without bias
+    return [
+        tune_models(
+            variables.iloc[train], targets.iloc[train], model_names, n_jobs, multioutput
+        )
+        for train, _ in ml.cv_folds(variables.shape[0], n_splits, n_repeats)
+    ]
@@ -1,13 +1,20 @@
+import json
 from typing import Tuple
 
+import pandas as pd
 import streamlit as st
 
 from aqua._constant import (
     available_targets,
     default_targets,
     normalization_strategies,
+    aggregation_strategies,
     available_models,
     default_models,
+    evaluation_strategies,
+    feature_perturbations,
+    default_processing_options,
+    default_modelling_options,
 )
 
 
@@ -26,9 +33,12 @@ def make_sidebar() -> Tuple[dict, dict]:
         "normalization": st.sidebar.selectbox(
             "Force normalization strategy", normalization_strategies
         ),
-        "imbalance": st.sidebar.checkbox("Compute left - right imbalance", value=True),
+        "imbalance": st.sidebar.checkbox(
+            "Compute left - right imbalance",
+            value=default_processing_options["imbalance"],
+        ),
         "aggregation": st.sidebar.selectbox(
-            "Left - right aggregation", ["F-score", "Mean"]
+            "Left - right aggregation", aggregation_strategies
         ),
     }
     st.sidebar.markdown(r">$\text{F-score} = 2 \times \frac{L \times R}{L + R}$")
@@ -40,10 +50,60 @@ def make_sidebar() -> Tuple[dict, dict]:
         "targets": st.sidebar.multiselect(
             "Target metrics", available_targets, default_targets
         ),
+        "evaluation": st.sidebar.selectbox("Evaluation", evaluation_strategies),
         "test_size": st.sidebar.number_input(
-            "Test split size (%)", min_value=0, max_value=100, value=20
+            "Test split size (%)",
+            min_value=0,
+            max_value=100,
+            value=default_modelling_options["test_size"],
+        ),
+        "n_splits": st.sidebar.number_input(
+            "Cross-validation folds",
+            min_value=2,
+            max_value=20,
+            value=default_modelling_options["n_splits"],
+        ),
+        "n_repeats": st.sidebar.number_input(
+            "Cross-validation repeats",
+            min_value=1,
+            max_value=20,
+            value=default_modelling_options["n_repeats"],
         ),
         "models": st.sidebar.multiselect("Models", available_models, default_models),
+        "multioutput": st.sidebar.checkbox(
+            "Fit all targets jointly when the model supports it",
+            value=default_modelling_options["multioutput"],
+        ),
+        "tune": st.sidebar.checkbox(
+            "Tune hyperparameters (successive halving)",
+            value=default_modelling_options["tune"],
+        ),
+        "feature_perturbation": st.sidebar.selectbox(
+            "SHAP feature perturbation", feature_perturbations
+        ),
     }
 
     return processing_options, modelling_options
+
+
+def make_performance_panel(records: list) -> None:
+    with st.expander("Performance"):
+        if not records:
+            st.markdown("No stage recorded.")
+            return
+        timings = pd.DataFrame(records).sort_values("start")
+        timings["stage"] = [
+            " " * depth + stage
+            for depth, stage in zip(timings["depth"], timings["stage"])
+        ]
+        st.markdown(f"Total: `{timings.query('depth == 0')['wall_time'].sum():.3f}` s")
+        st.dataframe(
+            timings[["stage", "wall_time", "cpu_time", "memory_delta"]].set_index(
+                "stage"
+            )
+        )
+        st.download_button(
+            "Export as JSON lines",
+            "".join(json.dumps(record) + "\n" for record in records),
+            file_name="performance.jsonl",
+        )
@@ -1,6 +1,7 @@
 import streamlit as st
 
-from aqua import ui, data, processing, ml, plots
+from aqua import ui, data, processing, ml, plots, bayes
+from aqua._constant import bayes_inferences
 
 ui.make_title()
 processing_options, modelling_options = ui.make_sidebar()
@@ -36,71 +37,45 @@ st.markdown(
     f"Test split size: `{X_test.shape[0]}` ({X_test.shape[0] / raw_data.shape[0]:.2f}%)"
 )
 
-st.markdown("### 2.1 Test split evaluation")
-
-# Dirty from here
-import pymc3 as pm
-import pandas as pd
-import matplotlib.pyplot as plt
-import arviz as az
-import numpy as np
-
-rename_cols = lambda x: x.lower().replace(" ", "_").replace("-", "_")
-train = pd.concat(
-    [(X_train - X_train.mean()) / X_train.std(), y_train], axis="columns"
-).rename(columns=rename_cols)
-var_cols = X_train.rename(columns=rename_cols).columns
-target = 'eb_mean_height'
-
-with pm.Model() as model:
-    pm.GLM.from_formula(f"{target} ~ {' + '.join(var_cols)}", train)
-    trace = pm.sample(5000)
-
-az.plot_trace(trace)
-plt.show()
-
-fig, ax = plt.subplots(figsize=(8, 8))
-ax.axvline(x=0, color="black", linewidth=3)
-az.plot_forest(
-    trace,
-    kind="ridgeplot",
-    combined=True,
-    var_names=var_cols,
-    colors="#800000",
-    ridgeplot_overlap=1.2,
-    ridgeplot_alpha=0.6,
-    linewidth=0,
-    show=False,
-    ax=ax,
+st.markdown("### 2.1 Bayesian linear regression")
+# standardized variables, the coefficients are comparable across variables
+X_test = bayes.standardize(X_test, X_train)
+X_train = bayes.standardize(X_train)
+target_names = y_train.columns.to_list()
+
+inference = st.selectbox("Inference", bayes_inferences, key="bayes-inference")
+trace = None
+if inference == "Sampling":
+    trace = bayes.fit(X_train, y_train)
+else:
+    posterior = bayes.conjugate_fit(X_train, y_train)
+    if st.checkbox("Refine with full sampling in the background", key="bayes-refine"):
+        refinement = bayes.refine(X_train, y_train)
+        if refinement.done():
+            trace = refinement.result()
+        else:
+            st.markdown("Sampling in the background, rerun to show its results.")
+
+if trace is None:
+    coefficients = bayes.conjugate_coefficients(posterior)
+    draws = bayes.conjugate_draws(posterior)
+else:
+    coefficients = bayes.coefficients(trace)
+    draws = bayes.posterior_draws(trace, 50)
+
+st.markdown("Posterior coefficients (mean and 90% interval)")
+plots.plot_coefficients(coefficients)
+
+st.markdown("Posterior predictive densities")
+plots.plot_predictive_density(
+    bayes.predictive_density(draws, X_train, target_names), y_train
 )
-az.plot_forest(
-    trace,
-    kind="forestplot",
-    colors="black",
-    combined=True,
-    var_names=var_cols,
-    ridgeplot_overlap=1.2,
-    show=False,
-    ax=ax,
-    linewidth=3,
-    credible_interval=0.9,
-)
-ax.set_xlim((-1, 1))
-ax.set_title("")
-plt.show()
-
-ppc = pm.sample_posterior_predictive(trace, samples=10, model=model)
-data_ppc = az.from_pymc3(trace=trace, posterior_predictive=ppc)
-
-az.plot_ppc(data_ppc, alpha=0.5)
-plt.show()
-
-az.plot_kde(train[target])
-az.plot_kde(ppc['y'])
-
-for sample in range(ppc['y'].shape[0]):
-    y_vals, lower, upper = az._fast_kde(ppc["y"][sample, :])
-    x_vals = np.linspace(lower, upper, y_vals.shape[0])
-    plt.plot(x_vals, y_vals, color='black')
-plt.show()
 
+if trace is None:
+    st.markdown("Test split predictive intervals (90%)")
+    intervals = bayes.conjugate_predictive_interval(posterior, X_test).assign(
+        real=y_test[target_names].to_numpy().ravel(order="F")
+    )
+    coverage = intervals.eval("lower <= real <= upper").mean()
+    st.markdown(f"Coverage: `{coverage:.2f}`")
+    st.dataframe(intervals)
@@ -0,0 +1,282 @@
+import argparse
+import inspect
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from aqua import (  # noqa: E402
+    cache,
+    correlation,
+    data,
+    density,
+    ml,
+    pipeline,
+    processing,
+    tables,
+)
+from aqua._constant import (  # noqa: E402
+    available_models,
+    aggregation_strategies,
+    available_targets,
+    normalization_strategies,
+    random_seed,
+)
+
+raw_data_path = Path(__file__).resolve().parents[1] / "data" / "raw.csv"
+output_path = "benchmark.json"
+sizes = [10**k for k in range(2, 7)]
+max_fit_rows = 10**5
+# path-dependent tree SHAP grows with the depth of trees fitted on many rows
+max_shap_rows = 100
+# imports timed in a fresh interpreter, "app" stands for the imports of app.py
+imported_modules = {
+    "aqua._constant": "aqua._constant",
+    "aqua.data": "aqua.data",
+    "aqua.ml": "aqua.ml",
+    "aqua.plots": "aqua.plots",
+    "app": "streamlit, aqua.ui, aqua.data, aqua.processing, aqua.ml, aqua.plots, "
+    "aqua.pipeline, aqua.profiling, aqua.registry, aqua.tuning",
+}
+tree_models = [model for model in available_models if "Regression" not in model]
+
+
+def make_synthetic_data(n_rows: int, seed: int = random_seed) -> pd.DataFrame:
+    # log-normal draws matching the means and covariance of the real data, so that
+    # forces, anthropometry and targets stay positive and correlated
+    reference = np.log(pd.read_csv(raw_data_path).dropna())
+    draws = np.random.default_rng(seed).multivariate_normal(
+        reference.mean(), reference.cov(), size=n_rows
+    )
+    return pd.DataFrame(np.exp(draws), columns=reference.columns)
+
+
+def measure(func, *args, repeat: int = 3) -> dict:
+    # best of `repeat` timings, the peak memory is traced in a separate run since
+    # tracemalloc slows down allocations (memory of joblib workers is not traced)
+    timings = []
+    for _ in range(repeat):
+        start, cpu_start = time.perf_counter(), time.process_time()
+        func(*args)
+        timings.append((time.perf_counter() - start, time.process_time() - cpu_start))
+    wall_time, cpu_time = min(timings)
+
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"wall_time": wall_time, "cpu_time": cpu_time, "peak_memory": peak}
+
+
+def build_store(csv_path: str, directory: str) -> dict:
+    # into a new store every time, an existing one is only checked for changes
+    return data.update_store(csv_path, tempfile.mkdtemp(dir=directory))
+
+
+def correlation_matrix(blocks: list) -> pd.DataFrame:
+    # the statistics are memoized per block, a cold run recomputes all of them
+    cache.clear()
+    return correlation.correlation_matrix(blocks)
+
+
+def run_pipeline(csv_path: str, directory: str, models: list) -> dict:
+    # the dashboard's flow from a cold start: new column store and model registry,
+    # empty in-memory caches
+    run_path = tempfile.mkdtemp(dir=directory)
+    cache.clear()
+    return pipeline.run(
+        modelling_options={"models": models},
+        data_path=shutil.copy(csv_path, run_path),
+        registry_path=os.path.join(run_path, "models"),
+    )
+
+
+def benchmark_size(n_rows: int, models: list, repeat: int) -> list:
+    # memoized entry points are unwrapped to time the work itself rather than cache
+    # hits
+    load_raw_data = inspect.unwrap(data.load_raw_data)
+    build_feature_set = inspect.unwrap(processing.build_feature_set)
+    train_models = inspect.unwrap(ml.train_models)
+    predict = inspect.unwrap(ml.predict)
+    get_shap_values = inspect.unwrap(ml.get_shap_values)
+    synthetic = make_synthetic_data(n_rows)
+    records = []
+
+    def record(stage: str, func, *args, **params):
+        result = measure(func, *args, repeat=repeat)
+        records.append({"stage": stage, "rows": n_rows, **params, **result})
+        print(f"{stage:<12} {n_rows:>8} {params} {result['wall_time']:.4f}s")
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = str(Path(directory) / "raw.csv")
+        synthetic.to_csv(csv_path, index=False)
+        record("load_csv", pd.read_csv, csv_path)
+        record("build_store", build_store, csv_path, directory)
+        data.update_store(csv_path)
+        record("load_store", load_raw_data, csv_path)
+        if n_rows <= max_fit_rows:
+            record("pipeline", run_pipeline, csv_path, directory, models)
+
+    features = processing.feature_data(synthetic)
+    record("feature_set", build_feature_set, features)
+    feature_set = build_feature_set(features)
+    for normalization in normalization_strategies:
+        for aggregation in aggregation_strategies:
+            options = {
+                "normalization": normalization,
+                "imbalance": True,
+                "aggregation": aggregation,
+            }
+            record(
+                "select",
+                feature_set.select,
+                options,
+                normalization=normalization,
+                aggregation=aggregation,
+            )
+
+    options = {"normalization": "Weight", "imbalance": True, "aggregation": "F-score"}
+    processed = processing.process_rows(synthetic, options)
+    targets, variables = ml.variables_targets_split(processed, available_targets)
+    melted = variables.melt()
+    record("describe", tables.describe_groups, melted, ["variable"])
+    record("density", inspect.unwrap(density.density_table), melted)
+    record("correlation", correlation_matrix, [variables, targets])
+
+    if n_rows > max_fit_rows:
+        return records
+
+    X_train, X_test, y_train, y_test = ml.train_test_split(variables, targets, 20)
+    for model_name in models:
+        record(
+            "train",
+            train_models,
+            X_train,
+            y_train,
+            [model_name],
+            model=model_name,
+        )
+        model = train_models(X_train, y_train, [model_name])[model_name]
+        record(
+            "predict",
+            predict,
+            X_test,
+            y_test,
+            model,
+            model=model_name,
+        )
+        if model_name in tree_models:
+            record(
+                "shap",
+                get_shap_values,
+                X_test.iloc[:max_shap_rows],
+                model,
+                model=model_name,
+            )
+    return records
+
+
+def benchmark_imports(modules: dict, repeat: int) -> list:
+    root = Path(__file__).resolve().parents[1]
+    records = []
+    for module, imports in modules.items():
+        statement = (
+            "import time; start = time.perf_counter(); "
+            f"import {imports}; "
+            "print(time.perf_counter() - start)"
+        )
+        timings = [
+            float(
+                subprocess.run(
+                    [sys.executable, "-c", statement],
+                    cwd=root,
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                ).stdout
+            )
+            for _ in range(repeat)
+        ]
+        records.append({"stage": "import", "module": module, "wall_time": min(timings)})
+        print(f"{'import':<12} {module} {min(timings):.4f}s")
+    return records
+
+
+def compare(records: list, baseline_path: str, tolerance: float) -> list:
+    # stages slower than the baseline by more than `tolerance` (relative)
+    with open(baseline_path) as f:
+        baseline = json.load(f)["records"]
+
+    def key(record: dict) -> tuple:
+        return tuple(
+            record.get(field)
+            for field in (
+                "stage",
+                "rows",
+                "model",
+                "normalization",
+                "aggregation",
+                "module",
+            )
+        )
+
+    reference = {key(record): record["wall_time"] for record in baseline}
+    return [
+        {**record, "baseline": reference[key(record)]}
+        for record in records
+        if key(record) in reference
+        and record["wall_time"] > reference[key(record)] * (1 + tolerance)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the aqua pipeline")
+    parser.add_argument("--sizes", type=int, nargs="+", default=sizes)
+    parser.add_argument("--models", nargs="+", default=available_models)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default=output_path)
+    parser.add_argument("--baseline", help="previous output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    records = benchmark_imports(imported_modules, args.repeat) + [
+        record
+        for n_rows in args.sizes
+        for record in benchmark_size(n_rows, args.models, args.repeat)
+    ]
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "numpy": np.__version__,
+                "pandas": pd.__version__,
+                "records": records,
+            },
+            f,
+            indent=2,
+        )
+
+    if args.baseline:
+        regressions = compare(records, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(
+                f"regression: {regression['stage']} ({regression['rows']} rows) "
+                f"{regression['baseline']:.4f}s -> {regression['wall_time']:.4f}s"
+            )
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,50 @@
+import argparse
+import time
+
 import numpy as np
 import pandas as pd
 
 raw_data_path = "~/Downloads/raw.csv"
-output_data_path = "../data"
+output_data_path = "../data/raw.csv"
+chunksize = 10_000
 
 
 def main():
-    (
-        pd.read_csv(raw_data_path)
-        .pipe(clean_column_names)
-        .pipe(anonymize)
-        .pipe(drop_very_low_forces)
-        .pipe(replace_nans_by_other_side)
-        .to_csv(f"{output_data_path}/raw.csv", index=False)
+    parser = argparse.ArgumentParser(description="Convert a raw test export")
+    parser.add_argument("input", nargs="?", default=raw_data_path)
+    parser.add_argument("output", nargs="?", default=output_data_path)
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=chunksize,
+        help="number of rows held in memory at once",
     )
+    args = parser.parse_args()
+    convert(args.input, args.output, args.chunksize)
+
+
+def convert(input_path: str, output_path: str, chunksize: int = chunksize) -> None:
+    start = time.perf_counter()
+    n_read = n_written = 0
+    with pd.read_csv(input_path, chunksize=chunksize) as reader:
+        for i, chunk in enumerate(reader):
+            n_read += chunk.shape[0]
+            converted = (
+                chunk.pipe(clean_column_names)
+                .pipe(anonymize)
+                .pipe(drop_very_low_forces)
+                .pipe(replace_nans_by_other_side)
+            )
+            converted.to_csv(
+                output_path, mode="w" if i == 0 else "a", header=i == 0, index=False
+            )
+            n_written += converted.shape[0]
+
+            elapsed = time.perf_counter() - start
+            print(
+                f"chunk {i}: {n_read} rows read, {n_written} written "
+                f"({n_read / elapsed:.0f} rows/s)"
+            )
 
 
 def clean_column_names(data: pd.DataFrame) -> pd.DataFrame:
@@ -32,17 +63,37 @@ def drop_very_low_forces(data: pd.DataFrame, threshold: int = 4) -> pd.DataFrame
     return data.loc[~to_drop]
 
 
+def side_pairs(columns: list) -> dict:
+    # maps every "<force>/L" column to its "<force>/R" counterpart and vice versa
+    pairs = {}
+    for column in columns:
+        other = f"{column[:-2]}/R"
+        if column.endswith("/L") and other in columns:
+            pairs[column], pairs[other] = other, column
+    return pairs
+
+
 def replace_nans_by_other_side(data: pd.DataFrame) -> pd.DataFrame:
-    nans = data.isna()
-    if not nans.any().any():
+    pairs = side_pairs(data.columns.to_list())
+    columns, others = list(pairs), list(pairs.values())
+    values = data[columns].to_numpy(dtype=float)
+    nans = np.isnan(values)
+    if not nans.any():
         return data
-    for row, col in np.argwhere(nans.values):
-        col_label = data.columns[col]
-        col_replacer = col + 1 if col_label.endswith("G") else col - 1
-        print(
-            f"\t`{col_label} = {data.iloc[row, col]}` replaced by `{data.columns[col_replacer]} = {data.iloc[row, col_replacer]}`"
-        )
-        data.iloc[row, col] = data.iloc[row, col_replacer]
+
+    filled = np.where(nans, data[others].to_numpy(dtype=float), values)
+    audit = pd.DataFrame(
+        {
+            "replaced by": others,
+            "replaced": nans.sum(axis=0),
+            "still missing": np.isnan(filled).sum(axis=0),
+        },
+        index=columns,
+    ).query("replaced > 0")
+    print(f"\tReplace NaNs by the other side:\n{audit}")
+
+    data = data.copy()
+    data[columns] = filled
     return data
 
 